@@ -1,5 +1,6 @@
 import random
 
+from delivery.geo_tables import publish_truck_positions
 from delivery.models import Location, Truck
 
 
@@ -12,3 +13,4 @@ def truck_location_update():
         truck.location = random.choice(locations)
         trucks_list.append(truck)
     Truck.objects.bulk_update(trucks_list, ['location'])
+    publish_truck_positions()
@@ -1,8 +1,70 @@
+import math
+from bisect import bisect_left
+from collections import Counter
+
 from django_filters import rest_framework as filters
 from geopy import distance
+from rest_framework.exceptions import ValidationError
 
+from delivery.geo_tables import get_truck_table, get_zip_neighbor_table
 from delivery.models import Truck, Cargo
 
+PRECISION_FAST = 'fast'
+PRECISION_EXACT = 'exact'
+PRECISION_CHOICES = ((PRECISION_FAST, 'fast'), (PRECISION_EXACT, 'exact'))
+
+# Mean Earth radius (IUGG) in miles.
+EARTH_RADIUS_MILES = 3958.7613
+
+# On the WGS-84 ellipsoid the radii of curvature lie between 6335.44 km (meridional, at the equator) and
+# 6399.59 km (at the poles), i.e. within -0.56% and +0.45% of the mean radius. Geodesic distances therefore
+# stay within that band of the spherical distance between the same coordinates; 0.6% leaves a margin.
+SPHERICAL_ERROR = 0.006
+
+# Distances of the ZIP neighbor table are geodesics stored as float32, exact to about 1e-7.
+NEIGHBOR_TABLE_ERROR = 1e-6
+
+
+def spherical_miles(point_a, point_b) -> float:
+    """Great-circle (haversine) distance in miles between two (latitude, longitude) points."""
+    lat_a, lon_a, lat_b, lon_b = map(math.radians, (point_a[0], point_a[1], point_b[0], point_b[1]))
+    h = math.sin((lat_b - lat_a) / 2) ** 2 + math.cos(lat_a) * math.cos(lat_b) * math.sin((lon_b - lon_a) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * math.asin(min(1.0, math.sqrt(h)))
+
+
+def get_precision(request) -> str:
+    """Return the distance precision requested by the API caller, 'fast' by default."""
+    if request is not None and request.GET.get('precision') == PRECISION_EXACT:
+        return PRECISION_EXACT
+    return PRECISION_FAST
+
+
+def band_labels(edges) -> list:
+    """Labels of the distance bands between the edges, e.g. ['0-100', '100-250']."""
+    bounds = [f'{edge:g}' for edge in [0, *edges]]
+    return [f'{low}-{high}' for low, high in zip(bounds, bounds[1:])]
+
+
+def get_truck_positions() -> list:
+    """
+    (number, ZIP code, latitude, longitude) of all trucks, from the shared truck table when it is published
+    and with one query otherwise.
+    """
+    table = get_truck_table()
+    if table is not None:
+        return table.positions()
+    return list(Truck.objects.values_list('number', 'location_id', 'location__latitude', 'location__longitude'))
+
+
+def get_distance_stats(request) -> Counter:
+    """Return the DistanceFilter work counters of the request, creating them on first use."""
+    if request is None:
+        return Counter()
+    http_request = getattr(request, '_request', request)
+    if not hasattr(http_request, 'distance_stats'):
+        http_request.distance_stats = Counter()
+    return http_request.distance_stats
+
 
 class DistanceFilter:
     """
@@ -11,10 +73,19 @@ class DistanceFilter:
     Args:
         obj: The Cargo object for which trucks are being filtered.
         miles_to_cargo (int): The maximum distance in miles to consider a truck for filtering (default: 450).
+        precision (str): 'fast' decides clear cases by the spherical distance and computes the geodesic only
+            near the boundary, 'exact' computes the geodesic for every truck (default: 'fast').
+        stats (Counter): Work counters to update, a new Counter if omitted.
+        cargo_point (tuple): The latitude and longitude of the pick-up location, used when obj is None.
+        pick_up (str): The ZIP code of the pick-up location, used when obj is None.
+        positions (list): Positions of the trucks from get_truck_positions(), shared between pick-up locations.
 
     Attributes:
         cargo_point (tuple): The latitude and longitude of the cargo's pick-up location.
+        pick_up (str): The ZIP code of the cargo's pick-up location.
         miles_to_cargo (int): The maximum distance in miles to consider a truck for filtering.
+        precision (str): 'fast' or 'exact'.
+        stats (Counter): 'exact_evaluations' and 'exact_avoided' geodesic counters.
 
     Methods:
         n_point(): Calculate the northernmost point within the given distance from the cargo.
@@ -22,16 +93,28 @@ class DistanceFilter:
         n_w_point(): Calculate the northwestern point within the given distance from the cargo.
         s_point(): Calculate the southernmost point within the given distance from the cargo.
         trucks_select(): Filter trucks based on their latitude and longitude within the specified region.
-        __distance_less(distance_to_cargo): Check if the given distance is less than or equal to the maximum distance.
+        truck_positions(all_trucks): Get the number, ZIP code, latitude and longitude of the trucks to check.
+        pick_up_neighbors(): Get the precomputed distances from the pick-up location, if they cover the radius.
+        neighbor_rows(table, positions): Get the ZIP neighbor table row of every truck, resolved once.
+        truck_band(truck_point, edges, table_miles): Find the distance band of the truck.
         __write_cargo(number, distance_to_cargo): Create a dictionary with truck number and distance.
         trucks_to_cargo(): Count the number of trucks within the specified distance from the cargo.
+        trucks_in_bands(edges): Count the number of trucks in every distance band from the cargo.
         all_trucks(): Get a list of trucks with their distances from the cargo.
 
     """
 
-    def __init__(self, obj, miles_to_cargo=450):
-        self.cargo_point = obj.pick_up.latitude, obj.pick_up.longitude
+    # (table, positions, rows) of neighbor_rows(), a class default as CargoFilter does not call __init__().
+    __neighbor_rows = None
+
+    def __init__(self, obj=None, miles_to_cargo=450, precision=PRECISION_FAST, stats=None, cargo_point=None,
+                 pick_up=None, positions=None):
+        self.cargo_point = cargo_point if obj is None else (obj.pick_up.latitude, obj.pick_up.longitude)
+        self.pick_up = pick_up if obj is None else obj.pick_up.zip_code
         self.miles_to_cargo = miles_to_cargo
+        self.precision = precision
+        self.stats = Counter() if stats is None else stats
+        self.positions = positions
 
     def n_point(self):
         """Calculate the northernmost point within the given distance from the cargo."""
@@ -67,6 +150,7 @@ class DistanceFilter:
                     'location__longitude').select_related()
         else:
             res = Truck.objects.only(
+                    'number',
                     'location__zip_code',
                     'location__latitude',
                     'location__longitude').select_related().filter(location__latitude__lte=self.n_point().latitude,
@@ -77,39 +161,116 @@ class DistanceFilter:
 
         return res
 
-    def __distance_less(self, distance_to_cargo):
-        """Check if the given distance is less than or equal to the maximum distance."""
-        return distance_to_cargo.__le__(self.miles_to_cargo)
+    def truck_positions(self, all_trucks=None) -> list:
+        """
+        Get the number, ZIP code, latitude and longitude of the trucks to check.
+
+        Positions come from the positions given to the filter, from the shared truck table when it is published,
+        without a query, and from trucks_select() otherwise.
+        """
+        if self.positions is not None:
+            return self.positions
+        table = get_truck_table()
+        if table is not None:
+            return table.positions()
+        return [(truck.number, truck.location_id, truck.location.latitude, truck.location.longitude)
+                for truck in self.trucks_select(all_trucks)]
+
+    def pick_up_neighbors(self):
+        """
+        Get the precomputed distances from the pick-up location, if the ZIP neighbor table is published
+        and covers miles_to_cargo. 'exact' precision does not use the table.
+        """
+        if self.precision != PRECISION_FAST or self.pick_up is None:
+            return None
+        table = get_zip_neighbor_table()
+        if table is None or table.max_miles < self.miles_to_cargo:
+            return None
+        return table.neighbors(self.pick_up)
+
+    def neighbor_rows(self, table, positions) -> list:
+        """
+        Row of every truck's ZIP code in the ZIP neighbor table, None for ZIP codes it does not know.
+        Resolved once per table and positions, so a filter reused across pick-up locations looks up every
+        truck once.
+        """
+        if self.__neighbor_rows is None or self.__neighbor_rows[0] is not table \
+                or self.__neighbor_rows[1] is not positions:
+            self.__neighbor_rows = (table, positions, [table.index(zip_code) for _, zip_code, _, _ in positions])
+        return self.__neighbor_rows[2]
 
     @staticmethod
     def __write_cargo(number, distance_to_cargo):
         """Create a dictionary with truck number and distance."""
         return {'truck number': number, 'distance': f'{distance_to_cargo:.2f} miles'}
 
+    def truck_band(self, truck_point, edges, table_miles=None) -> int:
+        """
+        Find the distance band of the truck: 0 up to edges[0] miles, i above edges[i - 1] and up to edges[i] miles,
+        len(edges) beyond the last edge.
+
+        A distance from the ZIP neighbor table (table_miles) settles the band without trigonometry. With 'fast'
+        precision the spherical distance settles every truck farther than SPHERICAL_ERROR from the band edges.
+        Only the remaining trucks get the geodesic, so the answer is always the same as the geodesic one.
+        """
+        if table_miles is not None:
+            band = bisect_left(edges, table_miles * (1 - NEIGHBOR_TABLE_ERROR))
+            if band == bisect_left(edges, table_miles * (1 + NEIGHBOR_TABLE_ERROR)):
+                self.stats['exact_avoided'] += 1
+                return band
+        if self.precision == PRECISION_FAST:
+            approximate = spherical_miles(self.cargo_point, truck_point)
+            band = bisect_left(edges, approximate * (1 - SPHERICAL_ERROR))
+            if band == bisect_left(edges, approximate * (1 + SPHERICAL_ERROR)):
+                self.stats['exact_avoided'] += 1
+                return band
+        self.stats['exact_evaluations'] += 1
+        return bisect_left(edges, distance.distance(self.cargo_point, truck_point).miles)
+
     def trucks_to_cargo(self) -> int:
         """Count the number of trucks within the specified distance from the cargo."""
-        trucks = 0
-        trucks_queryset = self.trucks_select()
-        for truck in trucks_queryset:
-            truck_point = (truck.location.latitude, truck.location.longitude)
-            distance_to_cargo = distance.distance(self.cargo_point, truck_point).miles
-            if self.__distance_less(distance_to_cargo):
-                trucks += 1
-        return trucks
+        return self.trucks_in_bands((self.miles_to_cargo,))[0]
+
+    def trucks_in_bands(self, edges) -> list:
+        """
+        Count the number of trucks in every distance band from the cargo, in one pass over the trucks.
+
+        Args:
+            edges (list): Sorted upper edges of the bands in miles.
+
+        Returns:
+            list: Number of trucks in every band, trucks beyond the last edge are not counted.
+
+        """
+        self.miles_to_cargo = edges[-1]
+        neighbors = self.pick_up_neighbors()
+        positions = self.truck_positions()
+        trucks = [0] * (len(edges) + 1)
+        if neighbors is None:
+            for _, _, latitude, longitude in positions:
+                trucks[self.truck_band((latitude, longitude), edges)] += 1
+        else:
+            rows = self.neighbor_rows(neighbors.table, positions)
+            for (_, _, latitude, longitude), row in zip(positions, rows):
+                trucks[self.truck_band((latitude, longitude), edges, neighbors.row_miles(row))] += 1
+        return trucks[:-1]
 
     def all_trucks(self) -> list:
         """Get a list of trucks with their distances from the cargo."""
         trucks = []
 
-        trucks_queryset = self.trucks_select(all_trucks=True)
-        for truck in trucks_queryset:
-            truck_point = (truck.location.latitude, truck.location.longitude)
-            distance_to_cargo = distance.distance(self.cargo_point, truck_point).miles
-            trucks.append(self.__write_cargo(truck.number, distance_to_cargo))
+        for number, _, latitude, longitude in self.truck_positions(all_trucks=True):
+            distance_to_cargo = distance.distance(self.cargo_point, (latitude, longitude)).miles
+            self.stats['exact_evaluations'] += 1
+            trucks.append(self.__write_cargo(number, distance_to_cargo))
 
         return trucks
 
 
+class NumberListFilter(filters.BaseCSVFilter, filters.NumberFilter):
+    """Comma-separated list of numbers."""
+
+
 class CargoFilter(filters.FilterSet, DistanceFilter):
     """
         FilterSet for Cargo objects with additional distance-based filtering.
@@ -121,20 +282,37 @@ class CargoFilter(filters.FilterSet, DistanceFilter):
             weight_from (filters.NumberFilter): Filter Cargo objects by weight greater than or equal to this value.
             weight_up_to (filters.NumberFilter): Filter Cargo objects by weight less than or equal to this value.
             miles_to_trucks (filters.NumberFilter): Filter Cargo objects by distance to nearby trucks.
+            precision (filters.ChoiceFilter): Distance precision, 'fast' (default) or 'exact'.
+            distance_bands (NumberListFilter): Comma-separated band edges in miles, the trucks of every cargo are
+                then counted per distance band.
 
         Methods:
             get_miles_to_trucks(qs, field_name, value): Custom filter method to calculate the distance to nearby trucks
                 for Cargo objects and filter them based on the given value.
+            get_distance_bands(qs, field_name, value): Validate the band edges and keep them on the request.
 
         """
 
     weight_from = filters.NumberFilter(label='weight from', field_name='weight', lookup_expr='gte')
     weight_up_to = filters.NumberFilter(label='weight up to', field_name='weight', lookup_expr='lte')
     miles_to_trucks = filters.NumberFilter(label='<= miles to trucks', method='get_miles_to_trucks')
+    precision = filters.ChoiceFilter(label='distance precision', choices=PRECISION_CHOICES, method='get_precision')
+    distance_bands = NumberListFilter(label='distance band edges, miles', method='get_distance_bands')
 
     class Meta:
         model = Cargo
-        fields = ('weight_from', 'weight_up_to', 'miles_to_trucks')
+        fields = ('weight_from', 'weight_up_to', 'miles_to_trucks', 'precision', 'distance_bands')
+
+    def get_precision(self, qs, field_name, value):
+        """Precision only changes how distances are evaluated, the queryset is left as is."""
+        return qs
+
+    def get_distance_bands(self, qs, field_name, value):
+        """Validate the band edges and keep them on the request, the queryset is left as is."""
+        if not value or any(edge is None or edge <= 0 for edge in value):
+            raise ValidationError({field_name: ['Band edges must be positive numbers.']})
+        self.request.distance_bands = sorted({float(edge) for edge in value})
+        return qs
 
     def get_miles_to_trucks(self, qs, field_name, value):
         """
@@ -150,13 +328,17 @@ class CargoFilter(filters.FilterSet, DistanceFilter):
             QuerySet: Filtered queryset containing Cargo objects that meet the distance criteria.
 
         """
-        qs_distinct = qs.filter().distinct('pick_up')
+        pick_ups = qs.order_by().values_list('pick_up', 'pick_up__latitude', 'pick_up__longitude').distinct()
         self.miles_to_cargo = int(value)
+        self.precision = self.form.cleaned_data.get('precision') or PRECISION_FAST
+        self.stats = get_distance_stats(self.request)
+        self.positions = get_truck_positions()
         obj_list = []
-        for obj in qs_distinct:
-            self.cargo_point = (obj.pick_up.latitude, obj.pick_up.longitude)
+        for zip_code, latitude, longitude in pick_ups:
+            self.cargo_point = (latitude, longitude)
+            self.pick_up = zip_code
             trucks = self.trucks_to_cargo()
             if trucks > 0:
-                self.request.data[str(obj.pick_up)] = trucks
-                obj_list.append(obj.pick_up)
+                self.request.data[zip_code] = trucks
+                obj_list.append(zip_code)
         return qs.filter(pick_up__in=obj_list)
@@ -0,0 +1,404 @@
+
+import fcntl
+import hashlib
+import logging
+import math
+import mmap
+import os
+import struct
+import threading
+from array import array
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from delivery.models import Location, Truck
+
+HEADER = struct.Struct('<8sQQ')
+CODE_SIZE = 5
+
+logger = logging.getLogger(__name__)
+
+
+def _aligned(offset):
+    return (offset + 7) // 8 * 8
+
+
+class _Codes:
+    """Sequence of the fixed-width codes of a column, decoded on access."""
+
+    def __init__(self, view, count):
+        self.view = view
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        start = index * CODE_SIZE
+        return bytes(self.view[start:start + CODE_SIZE]).decode('ascii').rstrip()
+
+
+class GeoTable:
+    """
+    Read-only packed table of coordinates, mapped into memory from a file.
+
+    The file holds a header (magic, version, row count) followed by columns: fixed-width codes,
+    then latitudes and longitudes as float64 arrays. Columns are read straight from the mapping,
+    so every process that maps the file shares the same pages and a forked worker that inherits
+    the mapping gets it without a copy.
+
+    Args:
+        path (str): The file to map.
+
+    Attributes:
+        version (int): Version of the table, increased by every publication.
+        count (int): Number of rows.
+        latitudes (memoryview): Latitude of every row.
+        longitudes (memoryview): Longitude of every row.
+
+    Methods:
+        write(path, version, codes, latitudes, longitudes): Publish a table by an atomic file swap.
+
+    """
+
+    magic = None
+    code_columns = ()
+    file_name = None
+
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            self.stat = os.fstat(file.fileno())
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.version, self.count = HEADER.unpack_from(self.buffer)
+        if magic != self.magic:
+            raise ValueError(f'{path} is not a {type(self).__name__} file')
+
+        view = memoryview(self.buffer)
+        offset = HEADER.size
+        for name in self.code_columns:
+            setattr(self, name, _Codes(view[offset:offset + CODE_SIZE * self.count], self.count))
+            offset = _aligned(offset + CODE_SIZE * self.count)
+        self.latitudes = view[offset:offset + 8 * self.count].cast('d')
+        offset += 8 * self.count
+        self.longitudes = view[offset:offset + 8 * self.count].cast('d')
+
+    @classmethod
+    def write(cls, path, version, codes, latitudes, longitudes):
+        """
+        Publish a table: write it next to path and swap it in with os.replace(), so readers see
+        either the previous table or the new one, never a partial file.
+
+        Args:
+            path (str): The file of the table.
+            version (int): Version of the new table.
+            codes (list): One list of codes per code column.
+            latitudes (list): Latitude of every row.
+            longitudes (list): Longitude of every row.
+
+        """
+        count = len(latitudes)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as file:
+            file.write(HEADER.pack(cls.magic, version, count))
+            offset = HEADER.size
+            for column in codes:
+                data = ''.join(code.ljust(CODE_SIZE) for code in column).encode('ascii')
+                if len(data) != CODE_SIZE * count:
+                    raise ValueError(f'codes must be at most {CODE_SIZE} characters')
+                padding = _aligned(offset + len(data)) - offset - len(data)
+                file.write(data + b'\0' * padding)
+                offset += len(data) + padding
+            file.write(array('d', latitudes).tobytes())
+            file.write(array('d', longitudes).tobytes())
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+
+
+class LocationTable(GeoTable):
+    """
+    Coordinates of every Location, sorted by ZIP code.
+
+    Methods:
+        point(zip_code): The latitude and longitude of the ZIP code, None if it is unknown.
+
+    """
+
+    magic = b'DSLOC001'
+    code_columns = ('zip_codes',)
+    file_name = 'locations.bin'
+
+    def point(self, zip_code):
+        """The latitude and longitude of the ZIP code, None if it is unknown."""
+        index = bisect_left(self.zip_codes, zip_code)
+        if index < self.count and self.zip_codes[index] == zip_code:
+            return self.latitudes[index], self.longitudes[index]
+        return None
+
+
+class TruckTable(GeoTable):
+    """
+    Current position of every truck, sorted by truck number.
+
+    Methods:
+        positions(): (number, ZIP code, latitude, longitude) of every truck.
+
+    """
+
+    magic = b'DSTRK001'
+    code_columns = ('numbers', 'zip_codes')
+    file_name = 'trucks.bin'
+
+    def positions(self) -> list:
+        """(number, ZIP code, latitude, longitude) of every truck."""
+        numbers, zip_codes = self.numbers, self.zip_codes
+        return [(numbers[i], zip_codes[i], self.latitudes[i], self.longitudes[i]) for i in range(self.count)]
+
+
+class ZipNeighbors:
+    """Precomputed distances from one ZIP code to every ZIP code within the table radius."""
+
+    def __init__(self, table, indices, distances):
+        self.table = table
+        self.indices = indices
+        self.distances = distances
+
+    def miles(self, zip_code):
+        """
+        Distance in miles to the ZIP code: math.inf beyond the table radius, None for a ZIP code
+        the table does not know.
+        """
+        return self.row_miles(self.table.index(zip_code))
+
+    def row_miles(self, index):
+        """Distance in miles to the ZIP code of a table row, as miles(); index is None for an unknown ZIP code."""
+        if index is None:
+            return None
+        position = bisect_left(self.indices, index)
+        if position < len(self.indices) and self.indices[position] == index:
+            return self.distances[position]
+        return math.inf
+
+
+class ZipNeighborTable:
+    """
+    Geodesic distances between all ZIP codes closer than max_miles, built by build_zip_neighbors.
+
+    The file holds a header (magic, max_miles, row count, entry count, digest of the locations) and the
+    columns: ZIP codes sorted, row offsets (uint64), neighbor row indices (uint32, sorted within a row)
+    and distances in miles (float32).
+
+    Args:
+        path (str): The file to map.
+
+    Attributes:
+        max_miles (float): Radius of the table.
+        count (int): Number of ZIP codes.
+        entries (int): Number of stored distances.
+        digest (bytes): SHA-256 of the locations the table was built from.
+
+    Methods:
+        index(zip_code): Row of the ZIP code, None if it is unknown.
+        neighbors(zip_code): Distances from the ZIP code, None if it is unknown.
+
+    """
+
+    magic = b'DSNBR001'
+    header = struct.Struct('<8sdQQ32s')
+    file_name = 'zip_neighbors.bin'
+
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            self.stat = os.fstat(file.fileno())
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.max_miles, self.count, self.entries, self.digest = self.header.unpack_from(self.buffer)
+        if magic != self.magic:
+            raise ValueError(f'{path} is not a {type(self).__name__} file')
+
+        view = memoryview(self.buffer)
+        offset = self.header.size
+        self.zip_codes = _Codes(view[offset:offset + CODE_SIZE * self.count], self.count)
+        offset = _aligned(offset + CODE_SIZE * self.count)
+        self.offsets = view[offset:offset + 8 * (self.count + 1)].cast('Q')
+        offset += 8 * (self.count + 1)
+        self.indices = view[offset:offset + 4 * self.entries].cast('I')
+        offset += 4 * self.entries
+        self.distances = view[offset:offset + 4 * self.entries].cast('f')
+        # Location table version the digest was last checked against, see get_zip_neighbor_table().
+        self.checked_version = self.matches_locations = None
+
+    def index(self, zip_code):
+        """Row of the ZIP code, None if it is unknown."""
+        index = bisect_left(self.zip_codes, zip_code)
+        if index < self.count and self.zip_codes[index] == zip_code:
+            return index
+        return None
+
+    def neighbors(self, zip_code):
+        """Distances from the ZIP code, None if it is unknown."""
+        index = self.index(zip_code)
+        if index is None:
+            return None
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return ZipNeighbors(self, self.indices[start:end], self.distances[start:end])
+
+
+_attached = {}
+_attached_lock = threading.Lock()
+
+
+def table_path(table_class):
+    """Path of the table file, None when GEO_TABLES_DIR is not configured."""
+    if not settings.GEO_TABLES_DIR:
+        return None
+    return os.path.join(settings.GEO_TABLES_DIR, table_class.file_name)
+
+
+def get_table(table_class):
+    """
+    Return the attached table, mapping the file again after it has been swapped.
+
+    Returns None when GEO_TABLES_DIR is not configured or the table has not been published,
+    callers then read the database.
+    """
+    path = table_path(table_class)
+    if path is None:
+        return None
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    table = _attached.get(table_class)
+    if table is None or (table.stat.st_ino, table.stat.st_mtime_ns) != (stat.st_ino, stat.st_mtime_ns):
+        with _attached_lock:
+            table = _attached.get(table_class)
+            if table is None or (table.stat.st_ino, table.stat.st_mtime_ns) != (stat.st_ino, stat.st_mtime_ns):
+                table = _attached[table_class] = table_class(path)
+    return table
+
+
+def get_location_table():
+    return get_table(LocationTable)
+
+
+def get_truck_table():
+    return get_table(TruckTable)
+
+
+def locations_digest(rows) -> bytes:
+    """SHA-256 of the (ZIP code, latitude, longitude) rows of the locations, sorted by ZIP code."""
+    digest = hashlib.sha256()
+    for zip_code, latitude, longitude in rows:
+        digest.update(struct.pack('<5sdd', zip_code.encode('ascii'), latitude, longitude))
+    return digest.digest()
+
+
+def get_zip_neighbor_table():
+    """
+    Return the ZIP neighbor table if it was built from the current locations, None otherwise.
+
+    The digest of the table is checked once per mapping and location table version, against the published
+    location table or, when there is none, against the Location table.
+    """
+    table = get_table(ZipNeighborTable)
+    if table is None:
+        return None
+    locations = get_location_table()
+    version = locations.version if locations is not None else 0
+    if table.checked_version != version:
+        if locations is not None:
+            rows = ((locations.zip_codes[i], locations.latitudes[i], locations.longitudes[i])
+                    for i in range(locations.count))
+        else:
+            rows = Location.objects.order_by('zip_code').values_list('zip_code', 'latitude', 'longitude')
+        table.matches_locations = locations_digest(rows) == table.digest
+        table.checked_version = version
+        if not table.matches_locations:
+            logger.warning('%s was built from other locations and is ignored, run build_zip_neighbors',
+                           table_path(ZipNeighborTable))
+    return table if table.matches_locations else None
+
+
+def get_location_points(zip_codes, locations=None) -> dict:
+    """
+    Latitude and longitude of the ZIP codes, from the published location table and, with one query, from
+    the database for ZIP codes added after it was published. ZIP codes that do not exist are left out.
+
+    Args:
+        zip_codes (set): The ZIP codes.
+        locations (LocationTable): The published location table, get_location_table() if omitted.
+
+    """
+    locations = get_location_table() if locations is None else locations
+    points = {}
+    if locations is not None:
+        points = {zip_code: point for zip_code in zip_codes if (point := locations.point(zip_code)) is not None}
+    unknown = set(zip_codes) - points.keys()
+    if unknown:
+        points.update((zip_code, (latitude, longitude)) for zip_code, latitude, longitude in
+                      Location.objects.filter(zip_code__in=unknown).values_list('zip_code', 'latitude', 'longitude'))
+    return points
+
+
+def attach():
+    """Map the published tables in this process, so that processes forked from it inherit the mapping."""
+    get_zip_neighbor_table()
+    return get_location_table(), get_truck_table()
+
+
+@contextmanager
+def _publish_lock():
+    """
+    Hold an exclusive flock on GEO_TABLES_DIR/publish.lock, so that processes publish one after another and
+    a publication never replaces a table read from newer data, nor reuses a version.
+    """
+    os.makedirs(settings.GEO_TABLES_DIR, exist_ok=True)
+    with open(os.path.join(settings.GEO_TABLES_DIR, 'publish.lock'), 'a') as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def publish_locations():
+    """Publish the coordinates of all locations. Does nothing when GEO_TABLES_DIR is not configured."""
+    path = table_path(LocationTable)
+    if path is None:
+        return None
+    with _publish_lock():
+        rows = Location.objects.order_by('zip_code').values_list('zip_code', 'latitude', 'longitude')
+        zip_codes, latitudes, longitudes = zip(*rows) if rows else ((), (), ())
+        current = get_location_table()
+        LocationTable.write(path, current.version + 1 if current else 1, [zip_codes], latitudes, longitudes)
+        return get_location_table()
+
+
+def publish_truck_positions():
+    """
+    Publish the current position of all trucks and increase the fleet version.
+    Does nothing when GEO_TABLES_DIR is not configured.
+
+    Every call reads the whole fleet with one query and writes and fsyncs a new file, O(trucks) whatever
+    changed, so callers publish once per batch of updates rather than once per truck. Coordinates come from
+    the published location table, and from the database for ZIP codes added after it was published.
+    """
+    path = table_path(TruckTable)
+    if path is None:
+        return None
+    with _publish_lock():
+        locations = get_location_table()
+        if locations is None:
+            rows = Truck.objects.order_by('number').values_list('number', 'location_id',
+                                                                'location__latitude', 'location__longitude')
+        else:
+            trucks = Truck.objects.order_by('number').values_list('number', 'location_id')
+            points = get_location_points({zip_code for _, zip_code in trucks}, locations)
+            rows = [(number, zip_code, *points[zip_code]) for number, zip_code in trucks]
+        numbers, zip_codes, latitudes, longitudes = zip(*rows) if rows else ((), (), (), ())
+        current = get_truck_table()
+        TruckTable.write(path, current.version + 1 if current else 1, [numbers, zip_codes], latitudes, longitudes)
+        return get_truck_table()
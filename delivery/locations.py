@@ -0,0 +1,109 @@
+
+import bisect
+import threading
+
+from django.db.models import Count, Max
+
+from delivery.models import Location
+
+
+class LocationIndex:
+    """
+    In-memory prefix index over the Location table for zip and city/state typeahead.
+
+    The index is built once from a single query and then answers lookups with binary search over
+    sorted key arrays, so no LIKE queries reach the database.
+
+    Args:
+        rows: Iterable of (zip_code, city, state) tuples.
+
+    Attributes:
+        zip_keys (list): Sorted ZIP codes.
+        city_keys (list): Sorted 'city, state' keys in lower case.
+        state_keys (list): Sorted 'state, city' keys in lower case.
+
+    Methods:
+        from_db(): Build the index from the Location table.
+        search(query, limit): Find locations whose ZIP code, city or state starts with the query.
+
+    """
+
+    def __init__(self, rows):
+        entries = [{'zip_code': zip_code, 'city': city, 'state': state} for zip_code, city, state in rows]
+
+        by_zip = sorted(entries, key=lambda entry: entry['zip_code'])
+        self.zip_keys = [entry['zip_code'] for entry in by_zip]
+        self.zip_entries = by_zip
+
+        by_city = sorted((f"{entry['city']}, {entry['state']}".lower(), entry['zip_code'], entry) for entry in entries)
+        self.city_keys = [key for key, _, _ in by_city]
+        self.city_entries = [entry for _, _, entry in by_city]
+
+        by_state = sorted((f"{entry['state']}, {entry['city']}".lower(), entry['zip_code'], entry) for entry in entries)
+        self.state_keys = [key for key, _, _ in by_state]
+        self.state_entries = [entry for _, _, entry in by_state]
+
+    def __len__(self):
+        return len(self.zip_keys)
+
+    @classmethod
+    def from_db(cls):
+        """Build the index from the Location table."""
+        return cls(Location.objects.values_list('zip_code', 'city', 'state').iterator())
+
+    @staticmethod
+    def __prefix_scan(keys, entries, prefix, limit, found):
+        """Append up to limit entries whose key starts with prefix, skipping ZIP codes already found."""
+        position = bisect.bisect_left(keys, prefix)
+        while position < len(keys) and len(found) < limit and keys[position].startswith(prefix):
+            entry = entries[position]
+            found.setdefault(entry['zip_code'], entry)
+            position += 1
+
+    def search(self, query, limit=10) -> list:
+        """
+        Find locations whose ZIP code, city or state starts with the query.
+
+        A numeric query is matched against ZIP codes. Any other query is matched against
+        'city, state' first and then against 'state, city', so both 'austin' and 'austin, tex'
+        narrow down to Austin, Texas, while 'texas' lists Texas locations.
+
+        Args:
+            query (str): The prefix entered by the user.
+            limit (int): The maximum number of locations to return.
+
+        Returns:
+            list: Dictionaries with zip_code, city and state.
+
+        """
+        prefix = ' '.join(query.split()).lower()
+        if not prefix or limit < 1:
+            return []
+
+        found = {}
+        if prefix.isdigit():
+            self.__prefix_scan(self.zip_keys, self.zip_entries, prefix, limit, found)
+        else:
+            self.__prefix_scan(self.city_keys, self.city_entries, prefix, limit, found)
+            self.__prefix_scan(self.state_keys, self.state_entries, prefix, limit, found)
+        return list(found.values())
+
+
+_location_index = None
+_location_index_key = None
+_location_index_lock = threading.Lock()
+
+
+def get_location_index() -> LocationIndex:
+    """
+    Return the process-wide LocationIndex, rebuilt when the number of locations or the highest primary key
+    has changed since it was built. One aggregate query checks this on every call, so every server process
+    picks up locations loaded by another process. Locations edited in place are not detected.
+    """
+    global _location_index, _location_index_key
+    key = tuple(Location.objects.aggregate(count=Count('pk'), last=Max('pk')).values())
+    with _location_index_lock:
+        if _location_index is None or _location_index_key != key:
+            _location_index = LocationIndex.from_db()
+            _location_index_key = key
+        return _location_index
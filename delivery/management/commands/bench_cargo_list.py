@@ -0,0 +1,77 @@
+
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from delivery.filters import DistanceFilter
+from delivery.models import Cargo, Location
+from delivery.serializers import CargoListFastSerializer, CargoListSerializer
+
+
+class Command(BaseCommand):
+    """Compares CargoListSerializer with CargoListFastSerializer on generated cargo, rolled back afterwards."""
+
+    help = 'Benchmark cargo list serialization.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000])
+        parser.add_argument('--pick-ups', type=int, default=500, help='distinct pick-up locations')
+        parser.add_argument('--repeat', type=int, default=3)
+
+    @staticmethod
+    def request(trucks):
+        """A cargo-list request whose truck counts are already computed, so that only serialization is timed."""
+        request = Request(APIRequestFactory().get('/cargo-list/', {'miles_to_trucks': 450}))
+        request.data.update(trucks)
+        return request
+
+    def measure(self, render, repeat):
+        best = None
+        content = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            content = render()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best, content
+
+    def handle(self, *args, **options):
+        points = Location.objects.values_list('zip_code', 'latitude', 'longitude')[:options['pick_ups']]
+        if not points:
+            raise CommandError('Location table is empty, run load_locations first.')
+        zip_codes = [zip_code for zip_code, _, _ in points]
+        trucks = {zip_code: DistanceFilter(cargo_point=(latitude, longitude)).trucks_to_cargo()
+                  for zip_code, latitude, longitude in points}
+
+        renderer = JSONRenderer()
+        with transaction.atomic():
+            Cargo.objects.all().delete()
+            created = 0
+            for rows in sorted(options['rows']):
+                Cargo.objects.bulk_create((Cargo(pick_up_id=random.choice(zip_codes),
+                                                 delivery_id=random.choice(zip_codes),
+                                                 weight=random.randint(1, 1000),
+                                                 description=f'cargo {created + i}')
+                                           for i in range(rows - created)), batch_size=5000)
+                created = rows
+
+                queryset = Cargo.objects.select_related('pick_up', 'delivery')
+                model_time, model_content = self.measure(
+                    lambda: renderer.render(CargoListSerializer(queryset, many=True,
+                                                                context={'request': self.request(trucks)}).data),
+                    options['repeat'])
+                fast_time, fast_content = self.measure(
+                    lambda: renderer.render(CargoListFastSerializer(queryset,
+                                                                    context={'request': self.request(trucks)}).data),
+                    options['repeat'])
+
+                self.stdout.write(f'{rows} rows: CargoListSerializer {model_time:.3f} s, '
+                                  f'CargoListFastSerializer {fast_time:.3f} s, '
+                                  f'x{model_time / fast_time:.1f}, '
+                                  f'identical output: {model_content == fast_content}')
+            transaction.set_rollback(True)
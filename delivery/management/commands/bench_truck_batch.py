@@ -0,0 +1,62 @@
+
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import override_settings
+from rest_framework.test import APIRequestFactory
+
+from delivery.models import Location, Truck
+from delivery.views import TruckBatchUpdateView
+
+
+class Command(BaseCommand):
+    """
+    Measures TruckBatchUpdateView throughput on generated trucks, rolled back afterwards. Every request moves
+    --reports distinct trucks. Publishing to GEO_TABLES_DIR is turned off, as the rollback would not undo it.
+    """
+
+    help = 'Benchmark batch truck location updates.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--trucks', type=int, default=10000)
+        parser.add_argument('--reports', type=int, default=10000, help='reports (distinct trucks) per request')
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        zip_codes = list(Location.objects.values_list('zip_code', flat=True))
+        if not zip_codes:
+            raise CommandError('Location table is empty, run load_locations first.')
+        if not 0 < options['reports'] <= options['trucks']:
+            raise CommandError('--reports must be between 1 and --trucks.')
+
+        factory = APIRequestFactory()
+        view = TruckBatchUpdateView.as_view()
+        with override_settings(GEO_TABLES_DIR=''), transaction.atomic():
+            Truck.objects.all().delete()
+            Truck.objects.bulk_create((Truck(number=f'{i // 26 + 1000}{chr(65 + i % 26)}',
+                                             location_id=random.choice(zip_codes))
+                                       for i in range(options['trucks'])), batch_size=5000)
+            numbers = list(Truck.objects.values_list('number', flat=True))
+
+            timestamp = time.time()
+            for content_type in ('application/json', 'application/x-ndjson'):
+                for _ in range(options['repeat']):
+                    timestamp += 1
+                    reports = [{'number': number, 'zip': random.choice(zip_codes), 'timestamp': timestamp}
+                               for number in random.sample(numbers, options['reports'])]
+                    if content_type == 'application/json':
+                        body = json.dumps(reports)
+                    else:
+                        body = '\n'.join(json.dumps(report) for report in reports)
+
+                    start = time.perf_counter()
+                    response = view(factory.post('/truck-batch-update/', body, content_type=content_type))
+                    elapsed = time.perf_counter() - start
+                    result = response.data
+                    self.stdout.write(f"{content_type}: {options['reports']} reports in {elapsed:.3f} s, "
+                                      f"{options['reports'] / elapsed:,.0f} reports/s "
+                                      f"(applied {result['applied']}, skipped {result['skipped']})")
+            transaction.set_rollback(True)
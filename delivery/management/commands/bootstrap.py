@@ -0,0 +1,107 @@
+
+import io
+import os
+import time
+import urllib.error
+import urllib.request
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django_crontab.crontab import Crontab
+
+from delivery.location_snapshot import read_snapshot, restore_locations, write_snapshot
+from delivery.models import Location, Truck
+
+
+class Command(BaseCommand):
+    """
+    Prepares the service for its first request, skipping every step that is already done: migrations,
+    locations (restored from the prebuilt snapshot), trucks and cron jobs. Reports the time of every step.
+
+    With --wait-for it only waits until the started server answers the URL and reports the time to first
+    request, counted from --started-at.
+    """
+
+    help = 'Migrate, restore locations, create trucks and install cron jobs when needed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--snapshot', help='Location snapshot, LOCATION_SNAPSHOT by default')
+        parser.add_argument('--sha256', help='expected snapshot hash, LOCATION_SNAPSHOT_SHA256 by default')
+        parser.add_argument('--started-at', type=float, help='Unix time the container started, now by default')
+        parser.add_argument('--wait-for', metavar='URL', help='wait until the server answers the URL')
+        parser.add_argument('--timeout', type=float, default=300, help='seconds to wait for the server')
+
+    def handle(self, *args, **options):
+        started_at = options['started_at'] or time.time()
+        if options['wait_for']:
+            self.wait_for(options['wait_for'], started_at, options['timeout'])
+            return
+
+        steps = (('migrations', self.migrate), ('locations', self.locations), ('trucks', self.trucks),
+                 ('cron jobs', self.cron_jobs))
+        for name, step in steps:
+            start = time.perf_counter()
+            result = step(options)
+            self.stdout.write(f'{name:<12}{result:<52}{time.perf_counter() - start:>8.2f} s')
+        self.stdout.write(self.style.SUCCESS(f'bootstrap done {time.time() - started_at:.2f} s after start'))
+
+    def migrate(self, options):
+        executor = MigrationExecutor(connection)
+        plan = executor.migration_plan(executor.loader.graph.leaf_nodes())
+        if not plan:
+            return 'up to date'
+        call_command('migrate', interactive=False, verbosity=0)
+        return f'{len(plan)} applied'
+
+    def locations(self, options):
+        if Location.objects.exists():
+            return 'exist'
+        path = options['snapshot'] or settings.LOCATION_SNAPSHOT
+        try:
+            digest, rows = read_snapshot(path, options['sha256'] or settings.LOCATION_SNAPSHOT_SHA256)
+        except (OSError, ValueError) as error:
+            self.stderr.write(self.style.WARNING(f'snapshot not restored ({error}), loading the CSV file'))
+        else:
+            restore_locations(rows)
+            return f'{len(rows)} restored from snapshot {digest[:12]}'
+
+        call_command('load_locations', stdout=io.StringIO())
+        if os.path.exists(path):
+            return 'loaded from CSV'
+        write_snapshot(path, Location.objects.values_list('zip_code', 'city', 'state', 'latitude', 'longitude'))
+        return f'loaded from CSV, snapshot written to {os.path.basename(path)}'
+
+    def trucks(self, options):
+        if Truck.objects.exists():
+            return 'exist'
+        call_command('load_trucks', stdout=io.StringIO())
+        return f'{Truck.objects.count()} created'
+
+    def cron_jobs(self, options):
+        """Install the CRONJOBS unless exactly these jobs are installed already."""
+        with Crontab(readonly=True, verbosity=0) as current:
+            installed = [line for line in current.crontab_lines if current.settings.CRONTAB_COMMENT in line]
+        expected = Crontab(verbosity=0)
+        expected.add_jobs()
+        if sorted(installed) == sorted(expected.crontab_lines):
+            return 'installed'
+        call_command('crontab', 'add', verbosity=0)
+        return f'{len(expected.crontab_lines)} added'
+
+    def wait_for(self, url, started_at, timeout):
+        """Poll the URL until the server answers, with any status, and report the time since started_at."""
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                with urllib.request.urlopen(url, timeout=5):
+                    break
+            except urllib.error.HTTPError:
+                break
+            except (urllib.error.URLError, OSError) as error:
+                if time.monotonic() > deadline:
+                    raise CommandError(f'{url} did not answer within {timeout:g} s: {error}')
+                time.sleep(0.05)
+        self.stdout.write(self.style.SUCCESS(f'first request answered {time.time() - started_at:.2f} s after start'))
@@ -0,0 +1,35 @@
+
+import csv
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from delivery.location_snapshot import write_snapshot
+from delivery.models import Location
+
+
+class Command(BaseCommand):
+    """Writes the locations, from the Location table or the CSV file, to the snapshot restored by bootstrap."""
+
+    help = 'Build the Location snapshot restored by bootstrap.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--csv', help='read uszips.csv instead of the Location table')
+        parser.add_argument('--output', help='snapshot file, LOCATION_SNAPSHOT by default')
+
+    def handle(self, *args, **options):
+        path = options['output'] or settings.LOCATION_SNAPSHOT
+        start = time.perf_counter()
+        if options['csv']:
+            with open(options['csv'], newline='') as csvfile:
+                rows = [(row['zip'], row['city'], row['state_name'], float(row['lat']), float(row['lng']))
+                        for row in csv.DictReader(csvfile)]
+        else:
+            rows = list(Location.objects.values_list('zip_code', 'city', 'state', 'latitude', 'longitude'))
+        if not rows:
+            raise CommandError('No locations to write, run load_locations or pass --csv.')
+
+        digest = write_snapshot(path, rows)
+        self.stdout.write(self.style.SUCCESS(f'{len(rows)} locations written to {path} '
+                                             f'in {time.perf_counter() - start:.2f} s, sha256 {digest.hex()}'))
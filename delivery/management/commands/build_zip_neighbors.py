@@ -0,0 +1,137 @@
+
+import math
+import os
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from multiprocessing import Pool
+
+from django.core.management.base import BaseCommand, CommandError
+from geographiclib.geodesic import Geodesic
+
+from delivery.filters import SPHERICAL_ERROR, spherical_miles
+from delivery.geo_tables import CODE_SIZE, ZipNeighborTable, get_zip_neighbor_table, locations_digest, table_path
+from delivery.models import Location
+
+METERS_PER_MILE = 1609.344
+
+# The shortest degree of latitude (at the equator) in miles.
+MILES_PER_LATITUDE_DEGREE = 68.70
+
+_worker = {}
+
+
+def _init_worker(latitudes, longitudes, max_miles):
+    """Keep the locations, sorted by latitude as well, in the worker process."""
+    order = sorted(range(len(latitudes)), key=latitudes.__getitem__)
+    _worker.update(latitudes=latitudes, longitudes=longitudes, max_miles=max_miles,
+                   order=order, sorted_latitudes=[latitudes[i] for i in order])
+
+
+def _neighbor_row(index):
+    """Row indices and geodesic distances of all locations within max_miles, sorted by row index."""
+    latitudes, longitudes, max_miles = _worker['latitudes'], _worker['longitudes'], _worker['max_miles']
+    latitude, longitude = latitudes[index], longitudes[index]
+    window = max_miles / MILES_PER_LATITUDE_DEGREE * (1 + SPHERICAL_ERROR)
+    low = bisect_left(_worker['sorted_latitudes'], latitude - window)
+    high = bisect_right(_worker['sorted_latitudes'], latitude + window)
+
+    # A geodesic within the latitude window crosses at most this many degrees of longitude.
+    widest_latitude = abs(latitude) + window
+    longitude_window = window / math.cos(math.radians(widest_latitude)) if widest_latitude < 89 else 360
+
+    row = []
+    for other in _worker['order'][low:high]:
+        longitude_difference = abs(longitudes[other] - longitude)
+        if min(longitude_difference, 360 - longitude_difference) > longitude_window:
+            continue
+        other_point = (latitudes[other], longitudes[other])
+        if spherical_miles((latitude, longitude), other_point) * (1 - SPHERICAL_ERROR) > max_miles:
+            continue
+        miles = Geodesic.WGS84.Inverse(latitude, longitude, *other_point, Geodesic.DISTANCE)['s12'] / METERS_PER_MILE
+        if miles <= max_miles:
+            row.append((other, miles))
+    row.sort()
+    return array('I', (other for other, _ in row)), array('f', (miles for _, miles in row))
+
+
+class Command(BaseCommand):
+    """Precomputes the geodesic distances between all ZIP codes within a radius, in parallel."""
+
+    help = 'Build the ZIP neighbor table used to count trucks around pick-up locations.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-miles', type=float, default=900)
+        parser.add_argument('--workers', type=int, default=os.cpu_count())
+        parser.add_argument('--output', help='table file, GEO_TABLES_DIR/zip_neighbors.bin by default')
+        parser.add_argument('--force', action='store_true', help='rebuild an up-to-date table')
+
+    def handle(self, *args, **options):
+        path = options['output'] or table_path(ZipNeighborTable)
+        if path is None:
+            raise CommandError('GEO_TABLES_DIR is not configured and --output is not given')
+        max_miles = options['max_miles']
+
+        rows = list(Location.objects.order_by('zip_code').values_list('zip_code', 'latitude', 'longitude'))
+        if not rows:
+            raise CommandError('Location table is empty, run load_locations first.')
+        digest = locations_digest(rows)
+
+        current = ZipNeighborTable(path) if os.path.exists(path) else None
+        if current is not None and not options['force'] and current.digest == digest \
+                and current.max_miles == max_miles:
+            self.stdout.write(self.style.SUCCESS(f'{path} is up to date'))
+            return
+
+        start = time.perf_counter()
+        zip_codes, latitudes, longitudes = (list(column) for column in zip(*rows))
+        with Pool(options['workers'], _init_worker, (latitudes, longitudes, max_miles)) as pool:
+            entries = self.write(path, zip_codes, max_miles, digest,
+                                 pool.imap(_neighbor_row, range(len(zip_codes)), chunksize=64))
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(zip_codes)} ZIP codes, {entries} distances within {max_miles:g} miles '
+            f'written to {path} in {time.perf_counter() - start:.1f} s'))
+        get_zip_neighbor_table()
+
+    def write(self, path, zip_codes, max_miles, digest, neighbor_rows) -> int:
+        """
+        Stream the rows into the table file and swap it in with os.replace().
+        Distances go to a side file first, as the number of entries is only known at the end.
+        """
+        count = len(zip_codes)
+        header = ZipNeighborTable.header
+        codes = ''.join(zip_code.ljust(CODE_SIZE) for zip_code in zip_codes).encode('ascii')
+        codes += b'\0' * ((header.size + len(codes) + 7) // 8 * 8 - header.size - len(codes))
+
+        tmp_path, distances_path = f'{path}.{os.getpid()}.tmp', f'{path}.{os.getpid()}.distances.tmp'
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        offsets = array('Q', [0])
+        try:
+            with open(tmp_path, 'wb') as file, open(distances_path, 'w+b') as distances_file:
+                file.write(header.pack(ZipNeighborTable.magic, max_miles, count, 0, digest))
+                file.write(codes)
+                offsets_position = file.tell()
+                file.write(b'\0' * 8 * (count + 1))
+
+                for number, (indices, distances) in enumerate(neighbor_rows, 1):
+                    indices.tofile(file)
+                    distances.tofile(distances_file)
+                    offsets.append(offsets[-1] + len(indices))
+                    if number % max(count // 10, 1) == 0:
+                        self.stdout.write(f'{number}/{count} ZIP codes')
+
+                distances_file.seek(0)
+                while chunk := distances_file.read(1 << 24):
+                    file.write(chunk)
+                file.seek(offsets_position)
+                offsets.tofile(file)
+                file.seek(0)
+                file.write(header.pack(ZipNeighborTable.magic, max_miles, count, offsets[-1], digest))
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_path, path)
+        finally:
+            for leftover in (tmp_path, distances_path):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+        return offsets[-1]
@@ -19,12 +19,14 @@ class Command(BaseCommand):
         else:
             with open('uszips.csv', 'r') as csvfile:
                 reader = csv.DictReader(csvfile)
-                json_file = json.dumps(list(reader)).replace("'", "`")
+                json_file = json.dumps(list(reader))
 
+            # The rows go as a parameter, so names are stored as in the CSV file, apostrophes included,
+            # exactly as build_location_snapshot --csv stores them.
             sql_query = "INSERT INTO delivery_location (zip_code, city, state, latitude, longitude)" \
-                        " SELECT zip, city, state_name, lat, lng FROM json_to_recordset ('"f'{json_file}'"')" \
+                        " SELECT zip, city, state_name, lat, lng FROM json_to_recordset (%s::json)" \
                         " as x(zip text, lat float8, lng float8, city text, state_name text);"
 
             with connection.cursor() as cursor:
-                cursor.execute(sql_query)
+                cursor.execute(sql_query, [json_file])
             self.stdout.write(self.style.SUCCESS('locations created'))
@@ -0,0 +1,203 @@
+
+import json
+import math
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+
+from delivery.cron import truck_location_update
+from delivery.models import Cargo, Location, Truck
+
+CRON = 'truck_location_update (cron)'
+DEFAULT_MIX = 'cargo_list=3,cargo_list_filtered=3,cargo_detail=2,cargo_create=1,truck_update=1'
+
+
+def percentile(latencies, percent):
+    """Nearest-rank percentile of sorted latencies."""
+    if not latencies:
+        return 0.0
+    return latencies[min(len(latencies) - 1, max(0, math.ceil(percent / 100 * len(latencies)) - 1))]
+
+
+class Command(BaseCommand):
+    """
+    Drives a running instance with concurrent clients at a target rate while truck_location_update
+    fires on schedule, then reports throughput, latency percentiles and error rate per endpoint.
+    """
+
+    help = 'Load test a running delivery service.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://localhost:8000')
+        parser.add_argument('--rate', type=float, default=20, help='requests per second, all clients together')
+        parser.add_argument('--duration', type=float, default=60, help='seconds')
+        parser.add_argument('--clients', type=int, default=8)
+        parser.add_argument('--mix', default=DEFAULT_MIX, help='endpoint=weight pairs')
+        parser.add_argument('--cron-interval', type=float, default=180,
+                            help='seconds between truck_location_update runs, 0 disables them')
+        parser.add_argument('--timeout', type=float, default=30)
+        parser.add_argument('--keep', action='store_true', help='keep the cargo created by the test')
+
+    def handle(self, *args, **options):
+        if options['rate'] <= 0 or options['clients'] <= 0:
+            raise CommandError('--rate and --clients must be greater than 0.')
+        self.url = options['url'].rstrip('/')
+        self.timeout = options['timeout']
+        self.endpoints = {
+            'cargo_list': self.cargo_list,
+            'cargo_list_filtered': self.cargo_list_filtered,
+            'cargo_detail': self.cargo_detail,
+            'cargo_create': self.cargo_create,
+            'truck_update': self.truck_update,
+            }
+        mix = self.parse_mix(options['mix'])
+
+        self.zip_codes = list(Location.objects.values_list('zip_code', flat=True))
+        self.cargo_ids = list(Cargo.objects.values_list('pk', flat=True))
+        self.truck_ids = list(Truck.objects.values_list('pk', flat=True))
+        if not self.zip_codes or not self.truck_ids:
+            raise CommandError('Locations and trucks are required, run load_locations and load_trucks first.')
+        self.created_ids = []
+
+        self.results = defaultdict(list)
+        self.lock = threading.Lock()
+        stop = threading.Event()
+        deadline = time.perf_counter() + options['duration']
+        interval = options['clients'] / options['rate']
+
+        cron = threading.Thread(target=self.run_cron, args=(options['cron_interval'], stop), daemon=True)
+        clients = [threading.Thread(target=self.run_client, args=(mix, interval, deadline, random.Random(i)))
+                   for i in range(options['clients'])]
+        self.stdout.write(f"{options['clients']} clients, {options['rate']:g} req/s for {options['duration']:g} s "
+                          f"against {self.url}")
+        start = time.perf_counter()
+        cron.start()
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        elapsed = time.perf_counter() - start
+        stop.set()
+        cron.join()
+
+        self.report(elapsed, options['rate'])
+        if self.created_ids and not options['keep']:
+            Cargo.objects.filter(pk__in=self.created_ids).delete()
+
+    def parse_mix(self, value):
+        """Parse endpoint=weight pairs, a missing weight is 1. Weights must be finite, not negative and not all 0."""
+        mix = {}
+        for pair in value.split(','):
+            name, _, weight = pair.partition('=')
+            if name not in self.endpoints:
+                raise CommandError(f"Unknown endpoint '{name}', expected one of {', '.join(self.endpoints)}")
+            try:
+                mix[name] = float(weight or 1)
+            except ValueError:
+                raise CommandError(f"Weight of '{name}' must be a number, got '{weight}'")
+            if not 0 <= mix[name] < math.inf:
+                raise CommandError(f"Weight of '{name}' must be a finite number of at least 0, got '{weight}'")
+        if not sum(mix.values()):
+            raise CommandError('At least one --mix weight must be greater than 0.')
+        return mix
+
+    def run_client(self, mix, interval, deadline, rng):
+        """
+        Send requests every interval seconds, starting at a random offset, until the deadline.
+        A client that falls behind the schedule sends the next request right away. Latency is counted from
+        the scheduled time, not from the send, so the time a request waited for a slow previous one is
+        included (no coordinated omission).
+        """
+        names, weights = list(mix), list(mix.values())
+        next_time = time.perf_counter() + rng.uniform(0, interval)
+        while next_time < deadline and time.perf_counter() < deadline:
+            delay = next_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            name = rng.choices(names, weights)[0]
+            try:
+                ok = self.endpoints[name](rng)
+            except (urllib.error.URLError, OSError, ValueError):
+                ok = False
+            self.record(name, time.perf_counter() - next_time, ok)
+            next_time += interval
+
+    def run_cron(self, interval, stop):
+        """Fire truck_location_update every interval seconds."""
+        if not interval:
+            return
+        while not stop.wait(interval):
+            started = time.perf_counter()
+            truck_location_update()
+            self.record(CRON, time.perf_counter() - started, True)
+
+    def record(self, name, latency, ok):
+        with self.lock:
+            self.results[name].append((latency, ok))
+
+    def request(self, method, path, data=None):
+        """Send a request, return whether the response is 2xx and its content."""
+        body = json.dumps(data).encode() if data is not None else None
+        request = urllib.request.Request(f'{self.url}{path}', data=body, method=method,
+                                         headers={'Accept': 'application/json', 'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                content = response.read()
+                return 200 <= response.status < 300, content
+        except urllib.error.HTTPError as error:
+            return False, error.read()
+
+    def cargo_list(self, rng):
+        return self.request('GET', '/cargo-list/')[0]
+
+    def cargo_list_filtered(self, rng):
+        params = rng.choice(('miles_to_trucks=450', 'miles_to_trucks=100', 'weight_from=100&weight_up_to=500',
+                             'distance_bands=100,250,450,900'))
+        return self.request('GET', f'/cargo-list/?{params}')[0]
+
+    def cargo_detail(self, rng):
+        if not self.cargo_ids:
+            return self.cargo_create(rng)
+        return self.request('GET', f'/cargo-detail/{rng.choice(self.cargo_ids)}/')[0]
+
+    def cargo_create(self, rng):
+        ok, content = self.request('POST', '/cargo-create/', {'pick_up': rng.choice(self.zip_codes),
+                                                              'delivery': rng.choice(self.zip_codes),
+                                                              'weight': rng.randint(1, 1000),
+                                                              'description': 'load test'})
+        if ok:
+            cargo_id = json.loads(content)['id']
+            with self.lock:
+                self.created_ids.append(cargo_id)
+                self.cargo_ids.append(cargo_id)
+        return ok
+
+    def truck_update(self, rng):
+        return self.request('PATCH', f'/truck-update/{rng.choice(self.truck_ids)}/',
+                            {'location': rng.choice(self.zip_codes)})[0]
+
+    def report(self, elapsed, rate):
+        header = f"{'endpoint':<30}{'requests':>9}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        total = errors = 0
+        for name in sorted(self.results):
+            results = self.results[name]
+            latencies = sorted(latency * 1000 for latency, _ in results)
+            failed = sum(1 for _, ok in results if not ok)
+            if name != CRON:
+                total += len(results)
+                errors += failed
+            self.stdout.write(f'{name:<30}{len(results):>9}{len(results) / elapsed:>8.1f}'
+                              f'{percentile(latencies, 50):>9.1f}{percentile(latencies, 95):>9.1f}'
+                              f'{percentile(latencies, 99):>9.1f}{failed / len(results):>8.1%}')
+        self.stdout.write(f'{total} requests in {elapsed:.1f} s, {total / elapsed:.1f} req/s of {rate:g} targeted, '
+                          f'error rate {errors / max(total, 1):.1%}')
+        if total / elapsed < 0.95 * rate:
+            self.stdout.write(self.style.WARNING('Target rate not reached, the clients fell behind the schedule: '
+                                                 'raise --clients or lower --rate.'))
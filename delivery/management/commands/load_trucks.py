@@ -5,6 +5,7 @@ import string
 from django.core.management import BaseCommand
 
 
+from delivery.geo_tables import publish_truck_positions
 from delivery.models import Location, Truck
 
 
@@ -28,4 +29,5 @@ class Command(BaseCommand):
 
                 trucks_list.append(truck)
             Truck.objects.bulk_create(trucks_list)
+            publish_truck_positions()
             self.stdout.write(self.style.SUCCESS('trucks created'))
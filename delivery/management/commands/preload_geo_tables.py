@@ -0,0 +1,18 @@
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from delivery.geo_tables import publish_locations, publish_truck_positions
+
+
+class Command(BaseCommand):
+    """Publishes the location and truck position tables shared by server workers."""
+
+    def handle(self, *args, **kwargs):
+        if not settings.GEO_TABLES_DIR:
+            raise CommandError('GEO_TABLES_DIR is not configured')
+        self.stdout.write(f'Publish geo tables to {settings.GEO_TABLES_DIR}')
+        locations = publish_locations()
+        trucks = publish_truck_positions()
+        self.stdout.write(self.style.SUCCESS(f'{locations.count} locations, {trucks.count} trucks '
+                                             f'(version {trucks.version}) published'))
@@ -0,0 +1,101 @@
+
+import cProfile
+import fcntl
+import glob
+import hmac
+import json
+import os
+import random
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+
+class ProfilingMiddleware:
+    """
+    Opt-in profiling of single requests with cProfile.
+
+    A request is profiled when it carries the header 'X-Profile: <PROFILING_TOKEN>' or is picked by
+    PROFILING_SAMPLE_RATE. The profile is written to a ring of PROFILING_MAX_FILES files in PROFILING_DIR,
+    next to a JSON file with the endpoint, query parameters, status, duration, number of database queries
+    and DistanceFilter work counters. Without a token and a sample rate the middleware is not loaded at all.
+
+    Methods:
+        should_profile(request): Check if the request is to be profiled.
+        write(profiler, tags): Write the profile and its tags to the next file of the ring.
+
+    """
+
+    header = 'HTTP_X_PROFILE'
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_TOKEN and not settings.PROFILING_SAMPLE_RATE:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def should_profile(self, request) -> bool:
+        """Check if the request is to be profiled."""
+        token = request.META.get(self.header)
+        # WSGI header values are latin-1 strings, compare_digest() only accepts ASCII str.
+        if token and settings.PROFILING_TOKEN and hmac.compare_digest(token.encode('latin-1'),
+                                                                      settings.PROFILING_TOKEN.encode()):
+            return True
+        return random.random() < settings.PROFILING_SAMPLE_RATE
+
+    def __call__(self, request):
+        if not self.should_profile(request):
+            return self.get_response(request)
+
+        queries = 0
+
+        def count_queries(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        with connection.execute_wrapper(count_queries):
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+        duration = time.perf_counter() - start
+
+        match = request.resolver_match
+        self.write(profiler, {
+            'time': time.time(),
+            'method': request.method,
+            'path': request.path,
+            'endpoint': match.view_name if match else None,
+            'query_params': request.GET.dict(),
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 3),
+            'queries': queries,
+            'distance_stats': dict(getattr(request, 'distance_stats', {})),
+            })
+        return response
+
+    def write(self, profiler, tags):
+        """
+        Write the profile and its tags to the next file of the ring, replacing the oldest one. An flock on
+        PROFILING_DIR/ring.lock keeps server processes and threads from picking the same slot.
+        """
+        os.makedirs(settings.PROFILING_DIR, exist_ok=True)
+        with open(os.path.join(settings.PROFILING_DIR, 'ring.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            names = [os.path.join(settings.PROFILING_DIR, f'profile-{slot:03d}.prof')
+                     for slot in range(settings.PROFILING_MAX_FILES)]
+            existing = set(glob.glob(os.path.join(settings.PROFILING_DIR, 'profile-*.prof')))
+            free = [name for name in names if name not in existing]
+            path = free[0] if free else min(names, key=os.path.getmtime)
+
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            profiler.dump_stats(tmp_path)
+            os.replace(tmp_path, path)
+            with open(tmp_path, 'w') as file:
+                json.dump(tags, file, indent=2)
+            os.replace(tmp_path, f'{path[:-len(".prof")]}.json')
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.4 on 2026-10-19 20:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0003_alter_cargo_delivery_alter_cargo_pick_up_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='truck',
+            name='location_updated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
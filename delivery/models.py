@@ -65,6 +65,7 @@ class Truck(models.Model):
         number (str): The truck's unique identifier (5 characters).
         location (ForeignKey): The location where the truck is currently located.
         carrying_capacity (int): The maximum carrying capacity of the truck (1 to 1000 pounds).
+        location_updated_at (datetime): The time of the last location report, older reports are dropped.
 
     Methods:
         __str__(): Returns the truck's number as the string representation of the truck.
@@ -77,6 +78,7 @@ class Truck(models.Model):
     carrying_capacity = models.PositiveSmallIntegerField(default=1, validators=[MinValueValidator(1),
                                                                                 MaxValueValidator(1000)]
                                                          )
+    location_updated_at = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
         return str(self.number)
@@ -1,8 +1,9 @@
 
-import random
+from django.utils import timezone
 from rest_framework import serializers
 
-from delivery.filters import DistanceFilter
+from delivery.filters import DistanceFilter, band_labels, get_distance_stats, get_precision, get_truck_positions
+from delivery.geo_tables import get_location_points, publish_truck_positions
 from delivery.models import Truck, Cargo, Location
 
 
@@ -18,22 +19,18 @@ class CargoCreateSerializer(serializers.ModelSerializer):
         model = Cargo
         fields = ('id', 'pick_up', 'delivery', 'weight', 'description')
 
-    def validate_pick_up(self, value):
-        if not Location.objects.filter(zip_code=value):
-            message = 'Location matching query does not exist.'
-            raise serializers.ValidationError([message])
-        return value
-
-    def validate_delivery(self, value):
-        if not Location.objects.filter(zip_code=value):
-            message = 'Location matching query does not exist.'
-            raise serializers.ValidationError([message])
-        return value
+    def validate(self, attrs):
+        """Check both locations with one query."""
+        query_bulk = Location.objects.in_bulk(id_list=[attrs['pick_up'], attrs['delivery']], field_name='zip_code')
+        errors = {field: ['Location matching query does not exist.']
+                  for field in ('pick_up', 'delivery') if attrs[field] not in query_bulk}
+        if errors:
+            raise serializers.ValidationError(errors)
+        attrs['locations'] = query_bulk
+        return attrs
 
     def create(self, validated_data):
-        query_bulk = Location.objects.in_bulk(id_list=[validated_data['pick_up'], validated_data['delivery']],
-                                              field_name='zip_code'
-                                              )
+        query_bulk = validated_data['locations']
         instance = Cargo.objects.create(pick_up=query_bulk[validated_data['pick_up']],
                                         delivery=query_bulk[validated_data['delivery']],
                                         weight=validated_data['weight'],
@@ -64,13 +61,68 @@ class CargoListSerializer(serializers.ModelSerializer):
             return self.context['request'].data.get(str(obj.pick_up))
         else:
             if str(obj.pick_up) not in self.obj_dict:
-                trucks = DistanceFilter(obj).trucks_to_cargo()
+                request = self.context['request']
+                trucks = DistanceFilter(obj, precision=get_precision(request),
+                                        stats=get_distance_stats(request)).trucks_to_cargo()
                 self.obj_dict.update({str(obj.pick_up): trucks})
                 return trucks
             else:
                 return self.obj_dict.get(str(obj.pick_up))
 
 
+class CargoListFastSerializer:
+    """
+    Fast path for listing Cargo instances.
+
+    Produces the same output as CargoListSerializer, but reads values() tuples of exactly the listed
+    fields and builds the dictionaries directly instead of running per-field serializer machinery.
+
+    Args:
+        queryset (QuerySet): The filtered Cargo queryset.
+        context (dict): Serializer context with the request.
+
+    """
+
+    fields = ('pk', 'pick_up', 'delivery', 'weight', 'description')
+
+    def __init__(self, queryset, context):
+        self.queryset = queryset
+        self.context = context
+
+    def get_trucks(self, pick_ups) -> dict:
+        """
+        Number of trucks for every distinct pick-up zip code, or the number of trucks per distance band
+        when distance_bands are requested.
+        """
+        request = self.context['request']
+        edges = getattr(request, 'distance_bands', None)
+        if request.GET.get('miles_to_trucks') and not edges:
+            return {pick_up: request.data.get(pick_up) for pick_up in pick_ups}
+
+        precision = get_precision(request)
+        stats = get_distance_stats(request)
+        positions = get_truck_positions()
+        # One filter for all pick-up locations, so truck lookups in the ZIP neighbor table are shared.
+        distance_filter = DistanceFilter(precision=precision, stats=stats, positions=positions)
+        labels = band_labels(edges) if edges else None
+        trucks = {}
+        for zip_code, point in get_location_points(pick_ups).items():
+            distance_filter.cargo_point, distance_filter.pick_up = point, zip_code
+            if edges:
+                trucks[zip_code] = dict(zip(labels, distance_filter.trucks_in_bands(edges)))
+            else:
+                trucks[zip_code] = distance_filter.trucks_to_cargo()
+        return trucks
+
+    @property
+    def data(self) -> list:
+        rows = list(self.queryset.values_list(*self.fields))
+        trucks = self.get_trucks({row[1] for row in rows}) if rows else {}
+        return [{'pk': pk, 'pick_up': pick_up, 'delivery': delivery, 'weight': weight,
+                 'description': description, 'trucks': trucks.get(pick_up)}
+                for pk, pick_up, delivery, weight, description in rows]
+
+
 class CargoDetailSerializer(serializers.ModelSerializer):
     """
     Detailed information about a Cargo instance,
@@ -84,7 +136,7 @@ class CargoDetailSerializer(serializers.ModelSerializer):
         fields = ('pick_up', 'delivery', 'weight', 'description', 'trucks')
 
     def get_trucks(self, obj):
-        return DistanceFilter(obj).all_trucks()
+        return DistanceFilter(obj, stats=get_distance_stats(self.context.get('request'))).all_trucks()
 
 
 class CargoUpdateSerializer(serializers.ModelSerializer):
@@ -108,6 +160,14 @@ class CargoDestroySerializer(serializers.ModelSerializer):
         model = Cargo
 
 
+class LocationSearchSerializer(serializers.Serializer):
+    """
+    Query parameters of the location typeahead.
+    """
+    q = serializers.CharField(max_length=255, help_text='zip code, city or state prefix')
+    limit = serializers.IntegerField(min_value=1, max_value=50, default=10)
+
+
 class TruckCreateSerializer(serializers.ModelSerializer):
     """
     Serializer for creating a new Truck instance.
@@ -152,17 +212,27 @@ class TruckCreateSerializer(serializers.ModelSerializer):
         Returns:
             Truck: The newly created Truck instance.
         """
+        location = Location.objects.order_by('?').values_list('zip_code', flat=True).first()
         instance = Truck.objects.create(number=validated_data['number'],
                                         carrying_capacity=validated_data['carrying_capacity'],
-                                        location=random.choice(Location.objects.all()),
+                                        location_id=location,
                                         )
+        publish_truck_positions()
         return instance
 
 
 class TruckUpdateSerializer(serializers.ModelSerializer):
     """
     Serializer for updating the location of a Truck instance.
+
+    Every update republishes the positions of the whole fleet, see publish_truck_positions().
     """
     class Meta:
         model = Truck
         fields = ('location',)
+
+    def update(self, instance, validated_data):
+        validated_data['location_updated_at'] = timezone.now()
+        instance = super().update(instance, validated_data)
+        publish_truck_positions()
+        return instance
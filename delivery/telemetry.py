@@ -0,0 +1,135 @@
+
+import datetime
+
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from delivery.geo_tables import get_location_table, publish_truck_positions
+from delivery.models import Location, Truck
+
+CHUNK_SIZE = 500
+MAX_ERRORS = 100
+
+
+def _column(name):
+    return connection.ops.quote_name(Truck._meta.get_field(name).column)
+
+
+def update_from_values_supported() -> bool:
+    """UPDATE ... FROM (VALUES ...) is available on PostgreSQL and SQLite 3.33 or later."""
+    if connection.vendor == 'postgresql':
+        return True
+    return connection.vendor == 'sqlite' and connection.Database.sqlite_version_info >= (3, 33, 0)
+
+
+def update_positions(cursor, rows) -> int:
+    """
+    Move the trucks to their reported locations, skipping trucks whose location_updated_at is not older.
+
+    One UPDATE ... FROM (VALUES ...) statement updates the whole chunk. Databases without it get the same
+    UPDATE per row through executemany().
+
+    Args:
+        cursor: A database cursor.
+        rows (list): (number, zip_code, timestamp) of every truck, timestamps adapted for the database.
+
+    Returns:
+        int: Number of updated trucks.
+
+    """
+    table = connection.ops.quote_name(Truck._meta.db_table)
+    location, updated_at, number = _column('location'), _column('location_updated_at'), _column('number')
+    if update_from_values_supported():
+        values = ', '.join(['(%s, %s, %s)'] * len(rows))
+        cursor.execute(f'UPDATE {table} SET {location} = v.column2, {updated_at} = v.column3 '
+                       f'FROM (VALUES {values}) AS v WHERE {table}.{number} = v.column1 '
+                       f'AND ({table}.{updated_at} IS NULL OR {table}.{updated_at} < v.column3)',
+                       [value for row in rows for value in row])
+    else:
+        cursor.executemany(f'UPDATE {table} SET {location} = %s, {updated_at} = %s WHERE {number} = %s '
+                           f'AND ({updated_at} IS NULL OR {updated_at} < %s)',
+                           [(zip_code, timestamp, number, timestamp) for number, zip_code, timestamp in rows])
+    return cursor.rowcount
+
+
+def parse_timestamp(value, received_at):
+    """An ISO 8601 string or Unix time in seconds as an aware datetime, the receive time if missing."""
+    if value is None:
+        return received_at
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return datetime.datetime.fromtimestamp(value, tz=datetime.timezone.utc)
+    timestamp = parse_datetime(value) if isinstance(value, str) else None
+    if timestamp is None:
+        raise ValueError('timestamp must be an ISO 8601 date-time or Unix time')
+    return timestamp if timezone.is_aware(timestamp) else timezone.make_aware(timestamp, datetime.timezone.utc)
+
+
+def known_zip_codes(zip_codes) -> set:
+    """
+    The ZIP codes that exist. The shared location table answers when it is published, the database is
+    queried once for the ZIP codes it does not know, as locations may have been added since.
+    """
+    locations = get_location_table()
+    known = set()
+    if locations is not None:
+        known = {zip_code for zip_code in zip_codes if locations.point(zip_code) is not None}
+    unknown = set(zip_codes) - known
+    if unknown:
+        known.update(Location.objects.filter(zip_code__in=unknown).values_list('zip_code', flat=True))
+    return known
+
+
+def apply_truck_positions(reports) -> dict:
+    """
+    Apply a batch of truck location reports.
+
+    Reports are {'number', 'zip', 'timestamp'} dictionaries, timestamp being optional. Only the latest
+    report of every truck is kept and it is applied only if it is newer than the truck's location_updated_at,
+    with one UPDATE statement per chunk of CHUNK_SIZE trucks. Published truck positions are refreshed once.
+
+    Args:
+        reports (list): The location reports.
+
+    Returns:
+        dict: Number of received, applied and skipped (out-of-order or unknown truck) reports, and the first
+            MAX_ERRORS rejected reports with their index and error.
+
+    """
+    received_at = timezone.now()
+    errors = []
+    latest = {}
+    for index, report in enumerate(reports):
+        try:
+            if not isinstance(report, dict):
+                raise ValueError('report must be an object')
+            number, zip_code = report.get('number'), report.get('zip')
+            if not isinstance(number, str) or not 0 < len(number) <= 5:
+                raise ValueError('number must be a truck number')
+            if not isinstance(zip_code, str) or len(zip_code) != 5:
+                raise ValueError('zip must be a 5-digit zip code')
+            timestamp = parse_timestamp(report.get('timestamp'), received_at)
+        except (ValueError, OverflowError, OSError) as error:
+            errors.append({'index': index, 'error': str(error)})
+            continue
+        if number not in latest or latest[number][1] < timestamp:
+            latest[number] = (zip_code, timestamp, index)
+
+    known = known_zip_codes({zip_code for zip_code, _, _ in latest.values()})
+    for number, (zip_code, _, index) in list(latest.items()):
+        if zip_code not in known:
+            errors.append({'index': index, 'error': 'Location matching query does not exist.'})
+            del latest[number]
+
+    applied = 0
+    rows = [(number, zip_code, connection.ops.adapt_datetimefield_value(timestamp))
+            for number, (zip_code, timestamp, _) in latest.items()]
+    with transaction.atomic(), connection.cursor() as cursor:
+        for start in range(0, len(rows), CHUNK_SIZE):
+            applied += update_positions(cursor, rows[start:start + CHUNK_SIZE])
+    if applied:
+        publish_truck_positions()
+
+    errors.sort(key=lambda error: error['index'])
+    return {'received': len(reports), 'applied': applied, 'skipped': len(reports) - applied - len(errors),
+            'rejected': len(errors), 'errors': errors[:MAX_ERRORS]}
@@ -1,3 +1,599 @@
-from django.test import TestCase
+import io
+import json
+import math
+import os
+import random
+import string
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from unittest import mock
 
-# Create your tests here.
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from geopy import distance
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from delivery.filters import CargoFilter
+from delivery.geo_tables import ZipNeighborTable, get_truck_table, get_zip_neighbor_table, publish_locations, \
+    publish_truck_positions, table_path
+from delivery.location_snapshot import read_snapshot, restore_locations, write_snapshot
+from delivery.locations import LocationIndex
+from delivery.management.commands.load_test import Command as LoadTestCommand, percentile
+from delivery.models import Cargo, Location, Truck
+from delivery.serializers import CargoListFastSerializer, CargoListSerializer
+
+
+@override_settings(GEO_TABLES_DIR='', PROFILING_TOKEN='', PROFILING_SAMPLE_RATE=0)
+class QueryBudgetTests(TestCase):
+    """
+    Every endpoint must run the same number of queries whatever the number of trucks, cargo
+    and distinct pick-up locations. The query count of every endpoint is printed after the run.
+    """
+
+    # (trucks, cargo, distinct pick-up locations)
+    sizes = ((2, 3, 1), (10, 30, 10), (40, 120, 60))
+    query_counts = {}
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        print('\nQueries per request (by data size):')
+        for name, counts in sorted(cls.query_counts.items()):
+            print(f"  {name:<36}{' / '.join(map(str, counts))}")
+
+    def seed(self, trucks, cargo, pick_ups):
+        """Create locations across the US, trucks and cargo spread over the given number of pick-up locations."""
+        Cargo.objects.all().delete()
+        Truck.objects.all().delete()
+        Location.objects.all().delete()
+
+        rng = random.Random(trucks)
+        locations = Location.objects.bulk_create(
+            Location(zip_code=f'{10000 + i}', city=f'City {i}', state=rng.choice(('Texas', 'Ohio', 'Utah')),
+                     latitude=rng.uniform(25, 49), longitude=rng.uniform(-124, -67))
+            for i in range(max(pick_ups, trucks) + 10))
+        Truck.objects.bulk_create(
+            Truck(number=f'{1000 + i}{rng.choice(string.ascii_uppercase)}', carrying_capacity=rng.randint(1, 1000),
+                  location=rng.choice(locations))
+            for i in range(trucks))
+        Cargo.objects.bulk_create(
+            Cargo(pick_up=locations[i % pick_ups], delivery=rng.choice(locations), weight=rng.randint(1, 1000),
+                  description=f'cargo {i}')
+            for i in range(cargo))
+
+    def assertConstantQueries(self, name, method, url, data=None, **params):
+        """
+        Request the URL for every data size and check that the number of queries does not change.
+        url returns the URL for the seeded data, so does data when it is callable; params go to the query string.
+        """
+        counts = []
+        for size in self.sizes:
+            self.seed(*size)
+            path = url()
+            body = data() if callable(data) else data
+            with CaptureQueriesContext(connection) as queries:
+                if method == 'get':
+                    response = self.client.get(path, params, HTTP_ACCEPT='application/json')
+                else:
+                    response = getattr(self.client, method)(path, body, content_type='application/json',
+                                                            HTTP_ACCEPT='application/json')
+            self.assertLess(response.status_code, 300, (name, size, response.content))
+            counts.append(len(queries))
+        self.query_counts[name] = counts
+        self.assertEqual(len(set(counts)), 1, f'{name}: {counts} queries for {self.sizes}')
+
+    @staticmethod
+    def first_cargo():
+        return reverse('cargo_detail', args=[Cargo.objects.values_list('pk', flat=True).first()])
+
+    def test_cargo_create(self):
+        self.assertConstantQueries('cargo-create', 'post', lambda: reverse('cargo_create'),
+                                   {'pick_up': '10000', 'delivery': '10001', 'weight': 10, 'description': 'test'})
+
+    def test_cargo_list(self):
+        self.assertConstantQueries('cargo-list', 'get', lambda: reverse('cargo_list'))
+
+    def test_cargo_list_weight(self):
+        self.assertConstantQueries('cargo-list ?weight', 'get', lambda: reverse('cargo_list'),
+                                   weight_from=100, weight_up_to=900)
+
+    def test_cargo_list_miles_to_trucks(self):
+        self.assertConstantQueries('cargo-list ?miles_to_trucks', 'get', lambda: reverse('cargo_list'),
+                                   miles_to_trucks=900)
+
+    def test_cargo_list_distance_bands(self):
+        self.assertConstantQueries('cargo-list ?distance_bands', 'get', lambda: reverse('cargo_list'),
+                                   distance_bands='100,250,450,900')
+
+    def test_cargo_list_exact(self):
+        self.assertConstantQueries('cargo-list ?precision=exact', 'get', lambda: reverse('cargo_list'),
+                                   precision='exact')
+
+    def test_cargo_detail(self):
+        self.assertConstantQueries('cargo-detail', 'get', self.first_cargo)
+
+    def test_cargo_update(self):
+        self.assertConstantQueries(
+            'cargo-update', 'patch',
+            lambda: reverse('cargo_update', args=[Cargo.objects.values_list('pk', flat=True).first()]),
+            {'weight': 20})
+
+    def test_cargo_destroy(self):
+        self.assertConstantQueries(
+            'cargo-destroy', 'delete',
+            lambda: reverse('cargo_destroy', args=[Cargo.objects.values_list('pk', flat=True).first()]))
+
+    def test_truck_create(self):
+        self.assertConstantQueries('truck-create', 'post', lambda: reverse('truck_create'),
+                                   {'number': '9999Z', 'carrying_capacity': 500})
+
+    def test_truck_update(self):
+        self.assertConstantQueries(
+            'truck-update', 'patch',
+            lambda: reverse('truck_update', args=[Truck.objects.values_list('pk', flat=True).first()]),
+            {'location': '10003'})
+
+    def test_truck_batch_update(self):
+        self.assertConstantQueries(
+            'truck-batch-update', 'post', lambda: reverse('truck_batch_update'),
+            lambda: [{'number': number, 'zip': '10004'} for number in Truck.objects.values_list('number', flat=True)])
+
+    def test_location_search(self):
+        self.assertConstantQueries('location-search', 'get', lambda: reverse('location_search'), q='city 1')
+
+
+class TruckRingsMixin:
+    """Cargo at three pick-ups, trucks around each pick-up on rings at the given geodesic distances."""
+
+    pick_ups = {'20000': (40.0, -100.0), '20001': (34.0, -90.0), '20002': (47.5, -122.3)}
+    # Geodesic miles from the pick-up: clear cases and trucks within 0.01 mile of a 450 mile radius.
+    offsets = (10, 300, 449.99, 450.01, 447.5, 452.5, 600, 1200)
+
+    def setUp(self):
+        locations = [Location(zip_code=zip_code, city='Pick-up', state='Texas', latitude=latitude, longitude=longitude)
+                     for zip_code, (latitude, longitude) in self.pick_ups.items()]
+        for origin in self.pick_ups.values():
+            for bearing in range(0, 360, 45):
+                for miles in self.offsets:
+                    point = distance.distance(miles=miles).destination(origin, bearing=bearing)
+                    locations.append(Location(zip_code=f'{30000 + len(locations)}', city='Truck', state='Ohio',
+                                              latitude=point.latitude, longitude=point.longitude))
+        Location.objects.bulk_create(locations)
+        Truck.objects.bulk_create(Truck(number=f'{1000 + i}A', location=location)
+                                  for i, location in enumerate(locations[len(self.pick_ups):]))
+        Cargo.objects.bulk_create(Cargo(pick_up_id=zip_code, delivery_id=zip_code, weight=1, description='cargo')
+                                  for zip_code in self.pick_ups)
+        self.trucks = [(location.latitude, location.longitude) for location in locations[len(self.pick_ups):]]
+
+    def expected(self, miles):
+        return {zip_code: sum(distance.distance(point, truck).miles <= miles for truck in self.trucks) or None
+                for zip_code, point in self.pick_ups.items()}
+
+    def cargo_list(self, **params):
+        response = self.client.get(reverse('cargo_list'), params, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        trucks = {cargo['pick_up']: cargo['trucks'] for cargo in response.json()}
+        return trucks, int(response['X-Distance-Exact-Evaluations']), int(response['X-Distance-Exact-Avoided'])
+
+
+@override_settings(GEO_TABLES_DIR='', PROFILING_TOKEN='', PROFILING_SAMPLE_RATE=0)
+class DistancePrecisionTests(TruckRingsMixin, TestCase):
+    """
+    'fast' precision counts exactly the trucks 'exact' precision counts, trucks a few yards either side of the
+    radius included, and reports the geodesic evaluations it avoided.
+    """
+
+    def test_fast_matches_exact(self):
+        checked = len(self.trucks) * len(self.pick_ups)
+        for params in ({'miles_to_trucks': 450}, {'miles_to_trucks': 1000}, {}):
+            with self.subTest(**params):
+                exact, exact_evaluations, exact_avoided = self.cargo_list(precision='exact', **params)
+                fast, fast_evaluations, fast_avoided = self.cargo_list(precision='fast', **params)
+                self.assertEqual(fast, exact)
+                self.assertEqual(exact, self.expected(params.get('miles_to_trucks', 450)))
+                self.assertEqual((exact_evaluations, exact_avoided), (checked, 0))
+                self.assertEqual(fast_evaluations + fast_avoided, checked)
+                # Trucks within SPHERICAL_ERROR of the radius need the geodesic, the rest do not.
+                self.assertGreater(fast_evaluations, 0)
+                self.assertGreater(fast_avoided, fast_evaluations)
+
+
+@override_settings(GEO_TABLES_DIR='', PROFILING_TOKEN='', PROFILING_SAMPLE_RATE=0)
+class DistanceBandTests(TruckRingsMixin, TestCase):
+    """
+    Trucks counted per distance band add up to the miles_to_trucks counts of the band edges.
+    """
+
+    def bands(self, edges, **params):
+        response = self.client.get(reverse('cargo_list'), {'distance_bands': edges, **params},
+                                   HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        return {cargo['pick_up']: cargo['trucks'] for cargo in response.json()}
+
+    def test_cumulative_bands_match_miles_to_trucks(self):
+        edges = (100, 300, 450, 1000)
+        for precision in ('fast', 'exact'):
+            bands = self.bands(','.join(map(str, edges)), precision=precision)
+            for position, edge in enumerate(edges):
+                with self.subTest(precision=precision, edge=edge):
+                    within, _, _ = self.cargo_list(miles_to_trucks=edge, precision=precision)
+                    cumulative = {zip_code: sum(list(trucks.values())[:position + 1]) or None
+                                  for zip_code, trucks in bands.items()}
+                    self.assertEqual(cumulative, {**dict.fromkeys(self.pick_ups), **within})
+
+    def test_duplicate_edges_are_collapsed(self):
+        bands = self.bands('450,100,100,450.0')
+        self.assertEqual(bands, self.bands('100,450'))
+        self.assertEqual([list(trucks) for trucks in bands.values()], [['0-100', '100-450']] * len(self.pick_ups))
+
+    def test_invalid_edges(self):
+        for edges in ('0,100', '-5', 'abc', '100,'):
+            with self.subTest(edges=edges):
+                response = self.client.get(reverse('cargo_list'), {'distance_bands': edges},
+                                           HTTP_ACCEPT='application/json')
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('distance_bands', response.json())
+
+
+@override_settings(GEO_TABLES_DIR='', PROFILING_TOKEN='', PROFILING_SAMPLE_RATE=0)
+class CargoListSerializerTests(TestCase):
+    """
+    CargoListFastSerializer renders byte for byte what CargoListSerializer renders.
+    """
+
+    def setUp(self):
+        rng = random.Random(1)
+        locations = Location.objects.bulk_create(
+            Location(zip_code=f'{10000 + i}', city=f'City {i}', state='Texas',
+                     latitude=rng.uniform(25, 49), longitude=rng.uniform(-124, -67))
+            for i in range(30))
+        Truck.objects.bulk_create(Truck(number=f'{1000 + i}A', location=rng.choice(locations)) for i in range(15))
+        descriptions = ('plain', 'Café crème, 10 kg', 'Überseekiste — 東京', 'quote " and \\ backslash', '')
+        Cargo.objects.bulk_create(
+            Cargo(pick_up=locations[i % 12], delivery=rng.choice(locations), weight=rng.randint(1, 1000),
+                  description=descriptions[i % len(descriptions)])
+            for i in range(40))
+
+    def render(self, **params):
+        """Render both serializers for the cargo-list request with the given query parameters."""
+        renderer = JSONRenderer()
+        content = []
+        for serializer in (lambda qs, context: CargoListSerializer(qs, many=True, context=context),
+                           CargoListFastSerializer):
+            request = Request(APIRequestFactory().get('/cargo-list/', params))
+            queryset = CargoFilter(request.query_params, Cargo.objects.select_related('pick_up', 'delivery'),
+                                   request=request).qs
+            content.append(renderer.render(serializer(queryset, context={'request': request}).data))
+        return content
+
+    def test_plain(self):
+        model_content, fast_content = self.render()
+        self.assertEqual(fast_content, model_content)
+        self.assertIn('東京'.encode(), fast_content)
+
+    def test_miles_to_trucks(self):
+        for miles in (100, 450, 2000):
+            with self.subTest(miles=miles):
+                model_content, fast_content = self.render(miles_to_trucks=miles)
+                self.assertEqual(fast_content, model_content)
+                self.assertNotEqual(fast_content, b'[]')
+
+
+@override_settings(GEO_TABLES_DIR='', PROFILING_TOKEN='', PROFILING_SAMPLE_RATE=0)
+class TruckBatchUpdateTests(TestCase):
+    """
+    Batch location reports: latest report per truck wins, unknown locations are rejected.
+    """
+
+    def setUp(self):
+        Location.objects.bulk_create(Location(zip_code=f'{10000 + i}', city='City', state='Texas',
+                                              latitude=30 + i, longitude=-100 + i) for i in range(3))
+        self.truck = Truck.objects.create(number='1000A', location_id='10000')
+
+    def post(self, reports, content_type='application/json'):
+        if content_type == 'application/json':
+            body = json.dumps(reports)
+        else:
+            body = '\n'.join(json.dumps(report) for report in reports)
+        return self.client.post(reverse('truck_batch_update'), body, content_type=content_type,
+                                HTTP_ACCEPT='application/json')
+
+    def test_out_of_order_reports_are_dropped(self):
+        response = self.post([{'number': '1000A', 'zip': '10002', 'timestamp': '2024-01-01T10:00:00Z'},
+                              {'number': '1000A', 'zip': '10001', 'timestamp': '2024-01-01T09:00:00Z'}])
+        self.assertEqual(response.json()['applied'], 1)
+        self.truck.refresh_from_db()
+        self.assertEqual(self.truck.location_id, '10002')
+
+        response = self.post([{'number': '1000A', 'zip': '10001', 'timestamp': '2024-01-01T09:30:00Z'}],
+                             content_type='application/x-ndjson')
+        self.assertEqual(response.json()['skipped'], 1)
+        self.truck.refresh_from_db()
+        self.assertEqual(self.truck.location_id, '10002')
+
+    def test_per_row_fallback(self):
+        with mock.patch('delivery.telemetry.update_from_values_supported', return_value=False):
+            self.test_out_of_order_reports_are_dropped()
+
+    def test_location_added_after_table_publication(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(GEO_TABLES_DIR=directory):
+            publish_locations()
+            Location.objects.create(zip_code='10009', city='City', state='Texas', latitude=40, longitude=-90)
+            response = self.post([{'number': '1000A', 'zip': '10009'}])
+            self.assertEqual(response.json()['applied'], 1)
+            self.assertEqual(get_truck_table().positions(), [('1000A', '10009', 40, -90)])
+
+    def test_unknown_location_is_rejected(self):
+        response = self.post([{'number': '1000A', 'zip': '99999'}, {'number': '1000A'}])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['rejected'], 2)
+        self.assertEqual([error['index'] for error in response.json()['errors']], [0, 1])
+        self.truck.refresh_from_db()
+        self.assertEqual(self.truck.location_id, '10000')
+
+
+class LocationSnapshotTests(TestCase):
+    """
+    Location snapshots restore the same rows and are refused when their content does not match the hash.
+    """
+
+    rows = [('10001', 'New York', 'New York', 40.75064, -73.99728),
+            ('00501', 'Holtsville', 'New York', 40.8133, -73.0476),
+            ('99501', 'Anchorage', 'Alaska', 61.21675, -149.87589)]
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'locations.snapshot')
+
+    def test_restore(self):
+        digest = write_snapshot(self.path, self.rows)
+        _, rows = read_snapshot(self.path, digest.hex())
+        self.assertEqual(rows, sorted(self.rows))
+
+        self.assertEqual(restore_locations(rows), 3)
+        self.assertEqual(list(Location.objects.order_by('zip_code').values_list(
+            'zip_code', 'city', 'state', 'latitude', 'longitude')), sorted(self.rows))
+
+    def test_build_from_csv(self):
+        csv_path = os.path.join(os.path.dirname(self.path), 'uszips.csv')
+        with open(csv_path, 'w', newline='') as csvfile:
+            csvfile.write('zip,lat,lng,city,state_id,state_name\n'
+                          '83814,47.6928,-116.7811,Coeur d\'Alene,ID,Idaho\n'
+                          '00501,40.8133,-73.0476,Holtsville,NY,New York\n')
+        call_command('build_location_snapshot', '--csv', csv_path, '--output', self.path, stdout=io.StringIO())
+        self.assertEqual(read_snapshot(self.path)[1], [('00501', 'Holtsville', 'New York', 40.8133, -73.0476),
+                                                       ('83814', "Coeur d'Alene", 'Idaho', 47.6928, -116.7811)])
+
+    def test_corrupt_snapshot_is_refused(self):
+        write_snapshot(self.path, self.rows)
+        with self.assertRaisesMessage(ValueError, 'expected'):
+            read_snapshot(self.path, '0' * 64)
+        with open(self.path, 'r+b') as file:
+            file.seek(-1, os.SEEK_END)
+            last = file.read(1)
+            file.seek(-1, os.SEEK_END)
+            file.write(bytes([last[0] ^ 1]))
+        with self.assertRaisesMessage(ValueError, 'does not match its hash'):
+            read_snapshot(self.path)
+
+
+class LocationIndexTests(TestCase):
+    """
+    Typeahead by ZIP code, 'city, state' and 'state, city' prefixes.
+    """
+
+    index = LocationIndex([('73301', 'Austin', 'Texas'), ('78701', 'Austin', 'Texas'), ('55912', 'Austin', 'Minnesota'),
+                           ('10001', 'New York', 'New York'), ('12201', 'Albany', 'New York'),
+                           ('75201', 'Dallas', 'Texas')])
+
+    def zip_codes(self, query, limit=10):
+        return [entry['zip_code'] for entry in self.index.search(query, limit)]
+
+    def test_zip_prefix(self):
+        self.assertEqual(self.zip_codes('7'), ['73301', '75201', '78701'])
+        self.assertEqual(self.zip_codes('787'), ['78701'])
+        self.assertEqual(self.zip_codes('999'), [])
+
+    def test_city_state_prefix(self):
+        self.assertEqual(self.zip_codes('austin'), ['55912', '73301', '78701'])
+        self.assertEqual(self.zip_codes('austin, tex'), ['73301', '78701'])
+
+    def test_state_prefix(self):
+        self.assertEqual(self.zip_codes('texas'), ['73301', '78701', '75201'])
+        self.assertEqual(self.zip_codes('new york, alb'), ['12201'])
+
+    def test_city_and_state_matches_are_not_repeated(self):
+        # 'New York, New York' matches the city scan and the state scan.
+        self.assertEqual(self.zip_codes('new york'), ['10001', '12201'])
+
+    def test_limit(self):
+        self.assertEqual(self.zip_codes('austin', limit=2), ['55912', '73301'])
+        self.assertEqual(self.zip_codes('texas', limit=1), ['73301'])
+        self.assertEqual(self.zip_codes('austin', limit=0), [])
+
+    def test_index_follows_the_location_table(self):
+        def search(query):
+            response = self.client.get(reverse('location_search'), {'q': query}, HTTP_ACCEPT='application/json')
+            return [entry['zip_code'] for entry in response.json()]
+
+        self.assertEqual(search('austin'), [])
+        Location.objects.create(zip_code='73301', city='Austin', state='Texas', latitude=30.3, longitude=-97.7)
+        self.assertEqual(search('austin'), ['73301'])
+        Location.objects.create(zip_code='78701', city='Austin', state='Texas', latitude=30.3, longitude=-97.7)
+        self.assertEqual(search('austin'), ['73301', '78701'])
+        Location.objects.filter(zip_code='73301').delete()
+        self.assertEqual(search('austin'), ['78701'])
+
+    def test_whitespace_and_case(self):
+        self.assertEqual(self.zip_codes('  AUSTIN,   Tex '), ['73301', '78701'])
+        self.assertEqual(self.zip_codes('   '), [])
+        self.assertEqual(self.index.search(' 100 '), [{'zip_code': '10001', 'city': 'New York', 'state': 'New York'}])
+
+
+class GeoTablePublishTests(TestCase):
+    """
+    Publishing the truck table with a published location table.
+    """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(GEO_TABLES_DIR=directory.name, PROFILING_TOKEN='', PROFILING_SAMPLE_RATE=0)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        Location.objects.create(zip_code='10000', city='City', state='Texas', latitude=30, longitude=-100)
+        self.truck = Truck.objects.create(number='1000A', location_id='10000')
+        publish_locations()
+
+    def test_location_added_after_publication(self):
+        Location.objects.create(zip_code='10001', city='City', state='Texas', latitude=31.5, longitude=-101.5)
+        response = self.client.patch(reverse('truck_update', args=[self.truck.pk]), {'location': '10001'},
+                                     content_type='application/json', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(get_truck_table().positions(), [('1000A', '10001', 31.5, -101.5)])
+
+    def test_cargo_pick_up_added_after_publication(self):
+        publish_truck_positions()
+        Location.objects.create(zip_code='10001', city='City', state='Texas', latitude=31.5, longitude=-101.5)
+        Cargo.objects.create(pick_up_id='10001', delivery_id='10000', weight=1, description='cargo')
+        for params in ({}, {'distance_bands': '100,450'}):
+            with self.subTest(**params):
+                response = self.client.get(reverse('cargo_list'), params, HTTP_ACCEPT='application/json')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json()[0]['pick_up'], '10001')
+                self.assertTrue(response.json()[0]['trucks'])
+
+    def test_versions_increase(self):
+        versions = [publish_truck_positions().version for _ in range(3)]
+        self.assertEqual(versions, [versions[0], versions[0] + 1, versions[0] + 2])
+
+
+class ZipNeighborTableTests(TestCase):
+    """
+    The ZIP neighbor table built by build_zip_neighbors holds the geodesics within its radius and does not
+    change the truck counts.
+    """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(GEO_TABLES_DIR=directory.name, PROFILING_TOKEN='', PROFILING_SAMPLE_RATE=0)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        rng = random.Random(2)
+        self.locations = Location.objects.bulk_create(
+            Location(zip_code=f'{10000 + i}', city='City', state='Texas',
+                     latitude=rng.uniform(30, 45), longitude=rng.uniform(-110, -85))
+            for i in range(40))
+        Truck.objects.bulk_create(Truck(number=f'{1000 + i}A', location=rng.choice(self.locations))
+                                  for i in range(25))
+        Cargo.objects.bulk_create(Cargo(pick_up=location, delivery=location, weight=1, description='cargo')
+                                  for location in self.locations[:15])
+        call_command('build_zip_neighbors', '--max-miles', '500', '--workers', '1',
+                     '--output', table_path(ZipNeighborTable), stdout=io.StringIO())
+
+    def test_distances(self):
+        table = get_zip_neighbor_table()
+        self.assertEqual((table.max_miles, table.count), (500, 40))
+        origin = self.locations[0]
+        neighbors = table.neighbors(origin.zip_code)
+        for location in self.locations:
+            miles = distance.distance((origin.latitude, origin.longitude),
+                                      (location.latitude, location.longitude)).miles
+            if miles <= 500:
+                self.assertAlmostEqual(neighbors.miles(location.zip_code), miles, delta=miles * 1e-6 + 1e-6)
+            else:
+                self.assertEqual(neighbors.miles(location.zip_code), math.inf)
+        self.assertIsNone(neighbors.miles('99999'))
+        self.assertIsNone(table.neighbors('99999'))
+
+    def test_truck_counts_are_unchanged(self):
+        def cargo_list(**params):
+            response = self.client.get(reverse('cargo_list'), params, HTTP_ACCEPT='application/json')
+            return response.json(), int(response['X-Distance-Exact-Evaluations'])
+
+        for params in ({}, {'miles_to_trucks': 300}, {'distance_bands': '100,250,450'}):
+            with self.subTest(**params):
+                with_table, evaluations = cargo_list(**params)
+                with override_settings(GEO_TABLES_DIR=''):
+                    without_table, _ = cargo_list(**params)
+                self.assertEqual(with_table, without_table)
+                self.assertEqual(evaluations, 0)
+
+    def test_table_of_other_locations_is_ignored(self):
+        Location.objects.filter(pk=self.locations[0].pk).update(latitude=self.locations[0].latitude + 0.1)
+        publish_locations()
+        with self.assertLogs('delivery.geo_tables', 'WARNING'):
+            self.assertIsNone(get_zip_neighbor_table())
+
+
+class LoadTestTests(SimpleTestCase):
+    """
+    Nearest-rank percentiles, argument checks and latency measurement of the load_test command.
+    """
+
+    def test_percentile(self):
+        latencies = [1, 2, 3, 4]
+        self.assertEqual([percentile(latencies, p) for p in (0, 25, 50, 62.5, 75, 99, 100)], [1, 1, 2, 3, 3, 4, 4])
+        self.assertEqual(percentile([5], 50), 5)
+        self.assertEqual(percentile([], 50), 0.0)
+
+    def test_rate_and_clients_must_be_positive(self):
+        for args in (('--rate', '0'), ('--clients', '0'), ('--rate', '-1')):
+            with self.subTest(args=args), self.assertRaisesMessage(CommandError, 'greater than 0'):
+                call_command('load_test', *args)
+
+    def test_mix_weights(self):
+        for mix, message in (('cargo_list=abc', 'must be a number'), ('cargo_list=-1', 'at least 0'),
+                             ('cargo_list=nan', 'at least 0'), ('cargo_list=0,truck_update=0', 'greater than 0')):
+            with self.subTest(mix=mix), self.assertRaisesMessage(CommandError, message):
+                call_command('load_test', '--mix', mix)
+
+    def test_latency_counts_from_schedule(self):
+        """A client behind its schedule records the time its requests waited, not only their send time."""
+        command = LoadTestCommand()
+        command.results, command.lock = defaultdict(list), threading.Lock()
+        command.endpoints = {'slow': lambda rng: time.sleep(0.02) or True}
+        command.run_client({'slow': 1}, 0.005, time.perf_counter() + 0.1, random.Random(0))
+        latencies = [latency for latency, _ in command.results['slow']]
+        self.assertGreater(max(latencies), 2 * 0.02)
+
+
+class ProfilingMiddlewareTests(TestCase):
+    """
+    Requests carrying the profiling token are profiled, any other X-Profile value is ignored.
+    """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        settings = override_settings(GEO_TABLES_DIR='', PROFILING_TOKEN='secret', PROFILING_SAMPLE_RATE=0,
+                                     PROFILING_DIR=self.directory, PROFILING_MAX_FILES=2)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def get(self, token):
+        return self.client.get(reverse('location_search'), {'q': 'x'}, HTTP_X_PROFILE=token,
+                               HTTP_ACCEPT='application/json')
+
+    def test_token(self):
+        for token in ('sécret', 'wrong', ''):
+            with self.subTest(token=token):
+                self.assertEqual(self.get(token).status_code, 200)
+        self.assertEqual(os.listdir(self.directory), [])
+
+        for _ in range(3):
+            self.assertEqual(self.get('secret').status_code, 200)
+        self.assertEqual(sorted(name for name in os.listdir(self.directory) if name.startswith('profile-')),
+                         ['profile-000.json', 'profile-000.prof', 'profile-001.json', 'profile-001.prof'])
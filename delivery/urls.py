@@ -2,7 +2,7 @@ from django.urls import path
 
 from delivery.views import TruckCreateView, CargoCreateView, CargoDestroyView, CargoDetailView, CargoListView, \
     CargoUpdateView, \
-    TruckUpdateView
+    LocationSearchView, TruckBatchUpdateView, TruckUpdateView
 
 urlpatterns = [
     path('cargo-create/', CargoCreateView.as_view(), name='cargo_create'),
@@ -12,4 +12,6 @@ urlpatterns = [
     path('cargo-destroy/<int:pk>/', CargoDestroyView.as_view(), name='cargo_destroy'),
     path('truck-create/', TruckCreateView.as_view(), name='truck_create'),
     path('truck-update/<int:pk>/', TruckUpdateView.as_view(), name='truck_update'),
+    path('truck-batch-update/', TruckBatchUpdateView.as_view(), name='truck_batch_update'),
+    path('location-search/', LocationSearchView.as_view(), name='location_search'),
 ]
\ No newline at end of file
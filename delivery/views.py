@@ -1,12 +1,32 @@
 
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import generics
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import JSONParser
+from rest_framework.response import Response
+from rest_framework.views import APIView
 
-from delivery.filters import CargoFilter
+from delivery.filters import CargoFilter, get_distance_stats
+from delivery.locations import get_location_index
 from delivery.models import Truck, Cargo
+from delivery.parsers import NDJSONParser
 from delivery.serializers import CargoCreateSerializer, CargoDestroySerializer, \
-    CargoDetailSerializer, CargoListSerializer, \
-    CargoUpdateSerializer, TruckCreateSerializer, TruckUpdateSerializer
+    CargoDetailSerializer, CargoListFastSerializer, CargoListSerializer, \
+    CargoUpdateSerializer, LocationSearchSerializer, TruckCreateSerializer, TruckUpdateSerializer
+from delivery.telemetry import apply_truck_positions
+
+
+class DistanceStatsMixin:
+    """
+    Reports how many geodesic evaluations the request needed and how many the fast precision avoided.
+    """
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        stats = get_distance_stats(request)
+        response['X-Distance-Exact-Evaluations'] = stats['exact_evaluations']
+        response['X-Distance-Exact-Avoided'] = stats['exact_avoided']
+        return response
 
 
 class CargoCreateView(generics.CreateAPIView):
@@ -17,22 +37,28 @@ class CargoCreateView(generics.CreateAPIView):
     queryset = Cargo.objects.all()
 
 
-class CargoListView(generics.ListAPIView):
+class CargoListView(DistanceStatsMixin, generics.ListAPIView):
     """
     Cargo list with quantity trucks. Default distance to trucks 450 miles.
+    Distances are computed with 'fast' precision unless precision=exact is passed.
+    Rows are serialized by CargoListFastSerializer, CargoListSerializer describes the schema.
     """
-    queryset = Cargo.objects.select_related()
+    queryset = Cargo.objects.select_related('pick_up', 'delivery')
     serializer_class = CargoListSerializer
     filter_backends = (DjangoFilterBackend,)
     filterset_class = CargoFilter
 
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        return Response(CargoListFastSerializer(queryset, context=self.get_serializer_context()).data)
+
 
-class CargoDetailView(generics.RetrieveAPIView):
+class CargoDetailView(DistanceStatsMixin, generics.RetrieveAPIView):
     """
     Obtaining information about a specific cargo.
     List of numbers of ALL vehicles with distance to the selected load.
     """
-    queryset = Cargo.objects.select_related()
+    queryset = Cargo.objects.select_related('pick_up', 'delivery')
     serializer_class = CargoDetailSerializer
 
 
@@ -66,3 +92,28 @@ class TruckUpdateView(generics.UpdateAPIView):
     """
     queryset = Truck.objects.all()
     serializer_class = TruckUpdateSerializer
+
+
+class LocationSearchView(APIView):
+    """
+    Location typeahead by zip code, city or state prefix.
+    Served from an in-memory index, at most 50 locations per request.
+    """
+
+    def get(self, request):
+        params = LocationSearchSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        return Response(get_location_index().search(params.validated_data['q'], params.validated_data['limit']))
+
+
+class TruckBatchUpdateView(APIView):
+    """
+    Batch truck location reports: a JSON array or NDJSON of {"number", "zip", "timestamp"} objects.
+    Reports older than the last applied one of the truck are skipped.
+    """
+    parser_classes = (JSONParser, NDJSONParser)
+
+    def post(self, request):
+        if not isinstance(request.data, list):
+            raise ValidationError({'non_field_errors': ['Expected a list of location reports.']})
+        return Response(apply_truck_positions(request.data))
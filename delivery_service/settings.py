@@ -62,6 +62,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'debug_toolbar.middleware.DebugToolbarMiddleware',
+    'delivery.middleware.ProfilingMiddleware',
     ]
 
 ROOT_URLCONF = 'delivery_service.urls'
@@ -143,3 +144,19 @@ INTERNAL_IPS = ['127.0.0.1']
 CRONJOBS = [
     ('*/3 * * * *', 'delivery.cron.truck_location_update')
     ]
+
+# Directory of the packed location and truck position tables shared by server workers.
+# Empty disables the tables, trucks are then read from the database.
+GEO_TABLES_DIR = env('GEO_TABLES_DIR', default='')
+
+# Opt-in request profiling, see delivery.middleware.ProfilingMiddleware.
+# Disabled (not loaded) unless PROFILING_TOKEN or PROFILING_SAMPLE_RATE is set.
+PROFILING_TOKEN = env('PROFILING_TOKEN', default='')
+PROFILING_SAMPLE_RATE = env.float('PROFILING_SAMPLE_RATE', default=0)
+PROFILING_DIR = env('PROFILING_DIR', default=str(BASE_DIR / 'profiles'))
+PROFILING_MAX_FILES = env.int('PROFILING_MAX_FILES', default=50)
+
+# Prebuilt Location snapshot restored by the bootstrap command, see build_location_snapshot.
+# LOCATION_SNAPSHOT_SHA256 pins the expected content hash (hex), empty accepts any intact snapshot.
+LOCATION_SNAPSHOT = env('LOCATION_SNAPSHOT', default=str(BASE_DIR / 'locations.snapshot'))
+LOCATION_SNAPSHOT_SHA256 = env('LOCATION_SNAPSHOT_SHA256', default='')
@@ -0,0 +1,16 @@
+import multiprocessing
+import os
+
+bind = '0.0.0.0:8000'
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+
+# Load Django in the master process so that the geo tables mapped below are shared by all workers.
+preload_app = True
+
+
+def when_ready(server):
+    from delivery.geo_tables import attach
+
+    locations, trucks = attach()
+    server.log.info('Geo tables attached: %s locations, %s trucks',
+                    locations.count if locations else 0, trucks.count if trucks else 0)